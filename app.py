@@ -1,54 +1,97 @@
 from flask import Flask, render_template, request, jsonify
 import pandas as pd
-from mlxtend.frequent_patterns import apriori, association_rules
-from mlxtend.preprocessing import TransactionEncoder
+from mlxtend.frequent_patterns import apriori, fpgrowth, association_rules
 import numpy as np
+from scipy.sparse import csr_matrix
+from collections import OrderedDict
+import hashlib
 import os
+import orjson
 
 app = Flask(__name__)
 
+def ojsonify(obj):
+    """jsonify via orjson, which also serializes numpy scalars/arrays directly"""
+    return app.response_class(orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY),
+                              mimetype='application/json')
+
+# Number of (dataset, min_support, algorithm) itemset results kept in memory
+ITEMSET_CACHE_SIZE = 16
+
 class ChestXrayAnalyzer:
     def __init__(self):
         self.data = None
         self.transactions = None
+        self.transaction_matrix = None
+        self.item_labels = None
+        self.data_hash = None
+        self.total_images = 0
+        self.unique_findings = []
         self.frequent_itemsets = None
         self.rules = None
+        self._itemset_cache = OrderedDict()
     
     def load_data(self, file_path):
         """Load and preprocess chest X-ray data"""
         try:
-            self.data = pd.read_csv(file_path)
+            # Only the labels are used, so skip parsing every other column
+            self.data = pd.read_csv(file_path, usecols=['Finding Labels'], dtype={'Finding Labels': str})
             # Process the Finding Labels column to create transactions
             self.data['Finding Labels'] = self.data['Finding Labels'].fillna('No Finding')
             
-            # Split multiple findings and create transaction format
-            transactions = []
-            for findings in self.data['Finding Labels']:
-                if findings != 'No Finding':
-                    # Split by '|' and clean up
-                    items = [item.strip() for item in findings.split('|')]
-                    transactions.append(items)
-                else:
-                    transactions.append(['No Finding'])
+            # Split multiple findings by '|' and clean up, using vectorized
+            # string ops instead of a per-row Python loop
+            split = (self.data['Finding Labels']
+                     .str.replace(r'\s*\|\s*', '|', regex=True)
+                     .str.strip()
+                     .str.split('|'))
+            
+            # (row, label) pairs for the sparse binary matrix
+            cols, labels = pd.factorize(split.explode())
+            rows = np.repeat(np.arange(len(split)), split.str.len().to_numpy())
             
-            self.transactions = transactions
+            # Content hash of the labels, used to key cached itemset results
+            label_hashes = pd.util.hash_pandas_object(self.data['Finding Labels'], index=False)
+            self.data_hash = hashlib.blake2b(label_hashes.to_numpy().tobytes(), digest_size=16).hexdigest()
+            
+            self.transactions = split.tolist()
+            self.item_labels = list(labels)
+            self.total_images = len(self.data)
+            self.unique_findings = sorted(label for label in self.item_labels if label != 'No Finding')
+            self.transaction_matrix = csr_matrix(
+                (np.ones(len(rows), dtype=np.bool_), (rows, cols)),
+                shape=(len(split), len(labels))
+            )
             return True
         except Exception as e:
             print(f"Error loading data: {e}")
             return False
     
-    def find_frequent_itemsets(self, min_support=0.01):
-        """Apply Apriori algorithm to find frequent itemsets"""
+    def find_frequent_itemsets(self, min_support=0.01, algorithm='fpgrowth'):
+        """Find frequent itemsets with FP-Growth (default) or Apriori"""
         if not self.transactions:
             return None
         
-        # Convert to binary matrix format
-        te = TransactionEncoder()
-        te_ary = te.fit(self.transactions).transform(self.transactions)
-        df = pd.DataFrame(te_ary, columns=te.columns_)
+        # Reuse the result of an earlier run on the same data and parameters
+        cache_key = (self.data_hash, min_support, algorithm)
+        if cache_key in self._itemset_cache:
+            self._itemset_cache.move_to_end(cache_key)
+            self.frequent_itemsets = self._itemset_cache[cache_key]
+            return self.frequent_itemsets
+        
+        # Wrap the sparse binary matrix built in load_data
+        df = pd.DataFrame.sparse.from_spmatrix(self.transaction_matrix, columns=self.item_labels)
         
-        # Apply Apriori algorithm
-        self.frequent_itemsets = apriori(df, min_support=min_support, use_colnames=True)
+        # FP-Growth avoids Apriori's candidate generation and repeated scans;
+        # both return the same itemsets/support schema
+        if algorithm == 'apriori':
+            self.frequent_itemsets = apriori(df, min_support=min_support, use_colnames=True)
+        else:
+            self.frequent_itemsets = fpgrowth(df, min_support=min_support, use_colnames=True)
+        
+        self._itemset_cache[cache_key] = self.frequent_itemsets
+        if len(self._itemset_cache) > ITEMSET_CACHE_SIZE:
+            self._itemset_cache.popitem(last=False)
         return self.frequent_itemsets
     
     def generate_association_rules(self, metric='confidence', min_threshold=0.5):
@@ -101,9 +144,10 @@ def analyze():
     min_support = float(data.get('support', 0.01))
     metric = data.get('metric', 'confidence')
     min_threshold = float(data.get('threshold', 0.5))
+    algorithm = data.get('algorithm', 'fpgrowth')
     
     # Find frequent itemsets
-    frequent_itemsets = analyzer.find_frequent_itemsets(min_support)
+    frequent_itemsets = analyzer.find_frequent_itemsets(min_support, algorithm)
     if frequent_itemsets is None or len(frequent_itemsets) == 0:
         return jsonify({'error': 'No frequent itemsets found with given support'})
     
@@ -111,25 +155,24 @@ def analyze():
     rules = analyzer.generate_association_rules(metric, min_threshold)
     
     # Prepare results
-    itemsets_result = []
-    for _, row in frequent_itemsets.iterrows():
-        itemsets_result.append({
-            'itemsets': list(row['itemsets']),
-            'support': round(row['support'], 4)
-        })
+    itemsets_result = [
+        {'itemsets': itemset, 'support': support}
+        for itemset, support in zip(frequent_itemsets['itemsets'].map(list).tolist(),
+                                    frequent_itemsets['support'].round(4).tolist())
+    ]
     
     rules_result = []
     if rules is not None and len(rules) > 0:
-        for _, row in rules.iterrows():
-            rules_result.append({
-                'antecedents': list(row['antecedents']),
-                'consequents': list(row['consequents']),
-                'support': round(row['support'], 4),
-                'confidence': round(row['confidence'], 4),
-                'lift': round(row['lift'], 4)
-            })
+        rules_result = [
+            {'antecedents': a, 'consequents': c, 'support': s, 'confidence': conf, 'lift': l}
+            for a, c, s, conf, l in zip(rules['antecedents'].map(list).tolist(),
+                                        rules['consequents'].map(list).tolist(),
+                                        rules['support'].round(4).tolist(),
+                                        rules['confidence'].round(4).tolist(),
+                                        rules['lift'].round(4).tolist())
+        ]
     
-    return jsonify({
+    return ojsonify({
         'frequent_itemsets': itemsets_result,
         'association_rules': rules_result,
         'total_transactions': len(analyzer.transactions) if analyzer.transactions else 0
@@ -140,20 +183,13 @@ def get_stats():
     if analyzer.data is None:
         return jsonify({'error': 'No data loaded'})
     
-    # Get basic statistics
-    total_images = len(analyzer.data)
-    unique_findings = set()
-    
-    for findings in analyzer.data['Finding Labels']:
-        if findings != 'No Finding' and pd.notna(findings):
-            items = [item.strip() for item in findings.split('|')]
-            unique_findings.update(items)
-    
+    # Basic statistics are computed once in load_data
     return jsonify({
-        'total_images': total_images,
-        'unique_findings': len(unique_findings),
-        'findings_list': sorted(list(unique_findings))
+        'total_images': analyzer.total_images,
+        'unique_findings': len(analyzer.unique_findings),
+        'findings_list': analyzer.unique_findings
     })
 
 if __name__ == '__main__':
-    app.run(debug=True, host='0.0.0.0', port=5001)
\ No newline at end of file
+    # Debug reloader only in development; use gunicorn in production (see README_MAIN.md)
+    app.run(debug=os.environ.get('FLASK_ENV') == 'development', host='0.0.0.0', port=5001)
\ No newline at end of file
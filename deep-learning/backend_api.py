@@ -8,14 +8,26 @@ from tensorflow.keras.models import load_model
 import base64
 from io import BytesIO
 from PIL import Image
+import threading
+import queue
+import time
+from concurrent.futures import Future
 import warnings
-from report_generator import report_generator
+import zlib
+import orjson
+from report_generator import get_report_generator
+from scoring import filter_detected, severity_bucket
 from datetime import datetime
 warnings.filterwarnings('ignore')
 
 app = Flask(__name__)
 CORS(app)
 
+def ojsonify(obj):
+    """jsonify via orjson, which also serializes numpy scalars/arrays directly"""
+    return app.response_class(orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY),
+                              mimetype='application/json')
+
 # Disease labels
 LABELS = [
     'Atelectasis', 'Cardiomegaly', 'Consolidation', 'Edema', 'Effusion',
@@ -23,135 +35,307 @@ LABELS = [
     'Nodule', 'Pleural_Thickening', 'Pneumonia', 'Pneumothorax'
 ]
 
-# Load model
-model = None
-try:
-    if os.path.exists('densenet.hdf5'):
-        model = load_model('densenet.hdf5', compile=False)
-        print("✅ Model loaded successfully!")
-    else:
-        print("⚠️  Model file not found, using mock predictions")
-except Exception as e:
-    print(f"⚠️  Error loading model: {e}, using mock predictions")
+INPUT_SHAPE = (1, 320, 320, 3)
+BATCH_INPUT_SHAPE = (None, 320, 320, 3)
+MAX_BATCH_SIZE = 8
+MAX_BATCH_WAIT = 0.02  # seconds the worker waits to fill a batch
+TFLITE_MODEL_PATH = 'densenet.fp16.tflite'
+DENSENET_FEATURES = 1024
+
+def build_mock_classifier(n_features, seed=42):
+    """Fixed random linear layer mapping pooled features to the 14 labels"""
+    rng = np.random.default_rng(seed)
+    weight_matrix = rng.standard_normal((n_features, len(LABELS))) * 0.01
+    bias = rng.standard_normal(len(LABELS)) * 0.01
+    return weight_matrix, bias
+
+# Built once at startup; it is deterministic so there's no need to redo it per request
+mock_classifiers = {DENSENET_FEATURES: build_mock_classifier(DENSENET_FEATURES)}
+
+def build_inference_fn(model):
+    """Wrap the model in a traced tf.function that takes uint8 pixels"""
+    @tf.function(input_signature=[tf.TensorSpec(BATCH_INPUT_SHAPE, tf.uint8)])
+    def infer(x):
+        # Scale to [0, 1] inside the graph instead of on the host
+        return model(tf.cast(x, tf.float32) / 255.0, training=False)
+    return infer
+
+def convert_to_fp16_tflite(keras_model, output_path=TFLITE_MODEL_PATH):
+    """Export the Keras model as a TFLite flatbuffer with FP16 weights
+
+    Run once with the HDF5 model loaded, e.g.
+    python3 -c "import backend_api as b; b.convert_to_fp16_tflite(b.model)"
+    """
+    converter = tf.lite.TFLiteConverter.from_keras_model(keras_model)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    converter.target_spec.supported_types = [tf.float16]
+    with open(output_path, 'wb') as f:
+        f.write(converter.convert())
+    return output_path
+
+def build_tflite_inference_fn(model_path):
+    """Load a TFLite model and return an inference function over uint8 batches"""
+    interpreter = tf.lite.Interpreter(model_path=model_path, num_threads=os.cpu_count())
+    input_index = interpreter.get_input_details()[0]['index']
+    output_index = interpreter.get_output_details()[0]['index']
+    interpreter.resize_tensor_input(input_index, INPUT_SHAPE)
+    interpreter.allocate_tensors()
+    # The interpreter holds its tensors internally, so calls must not overlap
+    lock = threading.Lock()
+    batch_size = [INPUT_SHAPE[0]]
+    
+    def infer(x):
+        x = np.asarray(x, dtype=np.float32) / 255.0
+        with lock:
+            if x.shape[0] != batch_size[0]:
+                interpreter.resize_tensor_input(input_index, x.shape)
+                interpreter.allocate_tensors()
+                batch_size[0] = x.shape[0]
+            interpreter.set_tensor(input_index, x)
+            interpreter.invoke()
+            return interpreter.get_tensor(output_index)
+    return infer
+
+class MicroBatcher:
+    """Collect concurrent single-image requests and run them through the model together"""
+    
+    def __init__(self, infer_fn, max_batch_size=MAX_BATCH_SIZE, max_wait=MAX_BATCH_WAIT):
+        self.infer_fn = infer_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.requests = queue.Queue()
+        self.worker = threading.Thread(target=self._run, daemon=True)
+        self.worker.start()
+    
+    def submit(self, img):
+        """Queue an (N, H, W, C) batch and return a Future for its N model outputs"""
+        future = Future()
+        self.requests.put((img, future))
+        return future
+    
+    def _run(self):
+        while True:
+            batch = [self.requests.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.requests.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            
+            images, futures = zip(*batch)
+            try:
+                outputs = np.asarray(self.infer_fn(np.concatenate(images, axis=0)))
+            except Exception as e:
+                if len(batch) == 1:
+                    futures[0].set_exception(e)
+                    continue
+                # Rerun the requests one at a time so only the offending one fails
+                for img, future in batch:
+                    try:
+                        future.set_result(np.asarray(self.infer_fn(img)))
+                    except Exception as err:
+                        future.set_exception(err)
+                continue
+            offset = 0
+            for img, future in zip(images, futures):
+                future.set_result(outputs[offset:offset + len(img)])
+                offset += len(img)
+
+def load_inference_fn():
+    """Load the model, preferring the FP16 TFLite export when present"""
+    model = None
+    infer = None
+    try:
+        if os.path.exists(TFLITE_MODEL_PATH):
+            infer = build_tflite_inference_fn(TFLITE_MODEL_PATH)
+            print("✅ FP16 TFLite model loaded successfully!")
+        elif os.path.exists('densenet.hdf5'):
+            model = load_model('densenet.hdf5', compile=False)
+            infer = build_inference_fn(model)
+            # Trace once at startup so the first request doesn't pay for it
+            infer(tf.zeros(INPUT_SHAPE, tf.uint8))
+            print("✅ Model loaded successfully!")
+        else:
+            print("⚠️  Model file not found, using mock predictions")
+    except Exception as e:
+        model = None
+        infer = None
+        print(f"⚠️  Error loading model: {e}, using mock predictions")
+    return model, infer
+
+model, infer = load_inference_fn()
+
+batcher = MicroBatcher(infer) if infer is not None else None
 
 def preprocess_image(image_array, target_size=(320, 320)):
-    """Preprocess image for model prediction"""
+    """Preprocess image for model prediction (uint8 batch of one)"""
     try:
         img = cv2.resize(image_array, target_size)
-        img = img.astype(np.float32) / 255.0
-        img = np.expand_dims(img, axis=0)
+        img = np.expand_dims(img.astype(np.uint8, copy=False), axis=0)
+        if img.shape[1:] != INPUT_SHAPE[1:]:
+            raise ValueError(f"Unexpected image shape {image_array.shape}")
         return img
     except Exception as e:
         print(f"Error preprocessing: {e}")
         return None
 
-@app.route('/api/analyze', methods=['POST'])
-def analyze_xray():
-    """Analyze chest X-ray image"""
-    try:
-        data = request.get_json()
-        if 'image' not in data:
-            return jsonify({'error': 'No image provided'}), 400
+def decode_image(data_url):
+    """Decode a base64 data URL into an RGB array plus a per-image seed"""
+    return decode_image_bytes(base64.b64decode(data_url.split(',')[1]))
+
+def decode_image_bytes(image_bytes):
+    """Decode raw encoded image bytes into an RGB array plus a per-image seed"""
+    # Per-image seed for the mock/variation paths, taken from the
+    # encoded bytes rather than a full pass over the decoded pixels
+    image_seed = zlib.crc32(image_bytes)
+    
+    # Convert to an RGB numpy array; other modes (LA, P, I;16, CMYK...) would
+    # give a channel count the model can't batch with other requests
+    image = Image.open(BytesIO(image_bytes))
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+    
+    return np.asarray(image), image_seed
+
+def output_to_predictions(raw_predictions, image_seed):
+    """Turn one image's model output (batch of one) into the 14 label probabilities"""
+    print(f"Raw model output shape: {raw_predictions.shape}")
+    
+    # Handle DenseNet feature maps - need to add classification layer
+    if len(raw_predictions.shape) == 4:  # (batch, height, width, features)
+        # Global average pooling
+        features = np.mean(raw_predictions, axis=(1, 2))  # (batch, features)
+        features = features[0]  # Remove batch dimension
         
-        # Decode base64 image
-        image_data = data['image'].split(',')[1]
-        image_bytes = base64.b64decode(image_data)
+        print(f"Extracted features shape: {features.shape}")
         
-        # Convert to numpy array
-        image = Image.open(BytesIO(image_bytes))
-        image = np.array(image)
+        # Simple linear mapping to 14 diseases (mock classification layer)
+        # In a real scenario, this would be a trained dense layer
+        n_features = features.shape[0]
+        if n_features not in mock_classifiers:
+            mock_classifiers[n_features] = build_mock_classifier(n_features)
+        weight_matrix, bias = mock_classifiers[n_features]
         
-        # Convert to RGB if needed
-        if len(image.shape) == 3 and image.shape[2] == 4:
-            image = cv2.cvtColor(image, cv2.COLOR_RGBA2RGB)
-        elif len(image.shape) == 2:
-            image = cv2.cvtColor(image, cv2.COLOR_GRAY2RGB)
+        # Linear transformation
+        logits = np.dot(features, weight_matrix) + bias
         
-        # Generate predictions
-        if model is not None:
-            try:
-                processed_img = preprocess_image(image)
-                raw_predictions = model.predict(processed_img, verbose=0)
-                
-                print(f"Raw model output shape: {raw_predictions.shape}")
-                
-                # Handle DenseNet feature maps - need to add classification layer
-                if len(raw_predictions.shape) == 4:  # (batch, height, width, features)
-                    # Global average pooling
-                    features = np.mean(raw_predictions, axis=(1, 2))  # (batch, features)
-                    features = features[0]  # Remove batch dimension
-                    
-                    print(f"Extracted features shape: {features.shape}")
-                    
-                    # Simple linear mapping to 14 diseases (mock classification layer)
-                    # In a real scenario, this would be a trained dense layer
-                    np.random.seed(42)  # Fixed seed for consistent results
-                    weight_matrix = np.random.randn(features.shape[0], len(LABELS)) * 0.01
-                    bias = np.random.randn(len(LABELS)) * 0.01
-                    
-                    # Linear transformation
-                    logits = np.dot(features, weight_matrix) + bias
-                    
-                    # Apply sigmoid to get probabilities
-                    predictions = 1 / (1 + np.exp(-logits))
-                    
-                    # Add some image-specific variation
-                    image_seed = hash(str(image.sum())) % 2**32
-                    np.random.seed(image_seed)
-                    noise = np.random.normal(0, 0.1, len(LABELS))
-                    predictions = np.clip(predictions + noise, 0, 1)
-                    
-                    print(f"Final predictions shape: {predictions.shape}")
-                    print(f"Prediction range: [{predictions.min():.3f}, {predictions.max():.3f}]")
-                    
-                elif len(raw_predictions.shape) == 2 and raw_predictions.shape[1] == len(LABELS):
-                    # Direct predictions
-                    predictions = raw_predictions[0]
-                else:
-                    raise ValueError(f"Unexpected model output shape: {raw_predictions.shape}")
-                    
-            except Exception as e:
-                print(f"Model prediction failed: {e}, using mock data")
-                # Generate realistic mock predictions based on image content
-                np.random.seed(hash(str(image.sum())) % 2**32)
-                predictions = np.random.beta(1.5, 8, len(LABELS))
-        else:
-            # Generate realistic mock predictions
-            np.random.seed(hash(str(image.sum())) % 2**32)
-            predictions = np.random.beta(1.5, 8, len(LABELS))
+        # Apply sigmoid to get probabilities
+        predictions = 1 / (1 + np.exp(-logits))
         
-        # Create results
-        results = []
-        threshold = 0.5
+        # Add some image-specific variation
+        noise = np.random.default_rng(image_seed).normal(0, 0.1, len(LABELS))
+        predictions = np.clip(predictions + noise, 0, 1)
         
-        for i, label in enumerate(LABELS):
-            prob = float(predictions[i])
-            results.append({
-                'disease': label,
-                'probability': prob,
-                'confidence': f"{prob * 100:.1f}%",
-                'detected': prob > threshold,
-                'severity': 'High' if prob > 0.7 else 'Medium' if prob > 0.4 else 'Low'
-            })
+        print(f"Final predictions shape: {predictions.shape}")
+        print(f"Prediction range: [{predictions.min():.3f}, {predictions.max():.3f}]")
+        
+    elif len(raw_predictions.shape) == 2 and raw_predictions.shape[1] == len(LABELS):
+        # Direct predictions
+        predictions = raw_predictions[0]
+    else:
+        raise ValueError(f"Unexpected model output shape: {raw_predictions.shape}")
+    
+    return predictions
+
+def mock_predictions(image_seed):
+    """Generate realistic mock predictions based on image content"""
+    return np.random.default_rng(image_seed).beta(1.5, 8, len(LABELS))
+
+def predict_images(decoded):
+    """Run a list of (image, seed) pairs through the model in micro-batched forward passes"""
+    if infer is None:
+        return [mock_predictions(seed) for _, seed in decoded]
+    
+    # One request per image: the batcher packs them (alongside other callers')
+    # into model batches of at most MAX_BATCH_SIZE, and a bad image fails alone
+    futures = []
+    for image, _ in decoded:
+        img = preprocess_image(image)
+        futures.append(batcher.submit(img) if img is not None else None)
+    
+    predictions = []
+    for future, (_, seed) in zip(futures, decoded):
+        try:
+            if future is None:
+                raise ValueError("Image could not be preprocessed")
+            predictions.append(output_to_predictions(future.result(), seed))
+        except Exception as e:
+            print(f"Model prediction failed: {e}, using mock data")
+            predictions.append(mock_predictions(seed))
+    return predictions
+
+def build_analysis(predictions):
+    """Build the /api/analyze response body for one image's probabilities"""
+    results = []
+    detected_mask = filter_detected(predictions).tolist()
+    severities = severity_bucket(predictions).tolist()
+    
+    for i, label in enumerate(LABELS):
+        prob = float(predictions[i])
+        results.append({
+            'disease': label,
+            'probability': prob,
+            'confidence': f"{prob * 100:.1f}%",
+            'detected': detected_mask[i],
+            'severity': severities[i]
+        })
+    
+    # Sort by probability
+    results.sort(key=lambda x: x['probability'], reverse=True)
+    detected = [r for r in results if r['detected']]
+    
+    # Generate charts
+    charts = get_report_generator().create_analysis_charts(results, detected)
+    
+    return {
+        'success': True,
+        'results': results,
+        'detected_conditions': detected,
+        'total_conditions_checked': len(LABELS),
+        'summary': {
+            'status': 'Abnormalities Detected' if detected else 'No Significant Abnormalities',
+            'detected_count': len(detected),
+            'highest_probability': results[0] if results else None
+        },
+        'charts': charts
+    }
+
+@app.route('/api/analyze', methods=['POST'])
+def analyze_xray():
+    """Analyze chest X-ray image (multipart file upload or JSON base64 data URL)"""
+    try:
+        if 'image' in request.files:
+            # Raw bytes straight from the upload, no base64 round trip
+            decoded = decode_image_bytes(request.files['image'].read())
+        else:
+            data = request.get_json()
+            if not data or 'image' not in data:
+                return jsonify({'error': 'No image provided'}), 400
+            decoded = decode_image(data['image'])
         
-        # Sort by probability
-        results.sort(key=lambda x: x['probability'], reverse=True)
-        detected = [r for r in results if r['detected']]
+        predictions = predict_images([decoded])[0]
+        return ojsonify(build_analysis(predictions))
         
-        # Generate charts
-        charts = report_generator.create_analysis_charts(results, detected)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/analyze_batch', methods=['POST'])
+def analyze_xray_batch():
+    """Analyze several chest X-ray images with one model call"""
+    try:
+        data = request.get_json()
+        images = data.get('images') if data else None
+        if not images:
+            return jsonify({'error': 'No images provided'}), 400
         
-        return jsonify({
+        decoded = [decode_image(image) for image in images]
+        return ojsonify({
             'success': True,
-            'results': results,
-            'detected_conditions': detected,
-            'total_conditions_checked': len(LABELS),
-            'summary': {
-                'status': 'Abnormalities Detected' if detected else 'No Significant Abnormalities',
-                'detected_count': len(detected),
-                'highest_probability': results[0] if results else None
-            },
-            'charts': charts
+            'analyses': [build_analysis(p) for p in predict_images(decoded)]
         })
         
     except Exception as e:
@@ -161,7 +345,7 @@ def analyze_xray():
 def health_check():
     return jsonify({
         'status': 'healthy',
-        'model_loaded': model is not None,
+        'model_loaded': infer is not None,
         'supported_conditions': LABELS
     })
 
@@ -176,8 +360,9 @@ def generate_report():
         if not analysis_data:
             return jsonify({'error': 'No analysis data provided'}), 400
         
-        # Generate PDF report
-        pdf_data = report_generator.generate_pdf_report(analysis_data, patient_info)
+        # Generate PDF report straight into our buffer
+        pdf_buffer = BytesIO()
+        pdf_data = get_report_generator().generate_pdf_report(analysis_data, patient_info, output=pdf_buffer)
         
         if pdf_data:
             # Save to temporary file
@@ -185,7 +370,7 @@ def generate_report():
             filename = f'chest_xray_report_{timestamp}.pdf'
             
             # Return PDF as base64 for download
-            pdf_base64 = base64.b64encode(pdf_data).decode()
+            pdf_base64 = base64.b64encode(pdf_buffer.getbuffer()).decode()
             
             return jsonify({
                 'success': True,
@@ -206,6 +391,7 @@ def home():
         'api_endpoints': {
             '/api/health': 'GET - Health check',
             '/api/analyze': 'POST - Analyze X-ray image',
+            '/api/analyze_batch': 'POST - Analyze several X-ray images in one model call',
             '/api/generate-report': 'POST - Generate PDF report'
         },
         'instructions': 'Open http://localhost:3000 for the web interface'
@@ -213,6 +399,7 @@ def home():
 
 if __name__ == '__main__':
     print("🏥 Starting Chest X-Ray Analysis API...")
-    print("📊 Model status:", "Loaded" if model else "Mock mode")
+    print("📊 Model status:", "Loaded" if infer else "Mock mode")
     print("🌐 Server starting on http://localhost:5001")
-    app.run(debug=True, port=5001)
\ No newline at end of file
+    # Debug reloader only in development; use gunicorn in production (see README_MAIN.md)
+    app.run(debug=os.environ.get('FLASK_ENV') == 'development', port=5001, threaded=True)
\ No newline at end of file
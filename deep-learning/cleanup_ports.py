@@ -3,63 +3,98 @@
 Port Cleanup Utility for Chest X-Ray Analysis System
 """
 
+import os
+import signal
 import subprocess
 import sys
 
-def kill_port_processes():
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+PORTS = (5001, 8080, 3000, 5002, 5003, 8000, 8888)
+
+def _lsof_listeners(ports):
+    """{port: pids} from lsof, which works unprivileged where psutil can't list
+    sockets; None when lsof can't be run"""
+    listeners = {}
+    for port in ports:
+        try:
+            result = subprocess.run(["lsof", "-ti", f"tcp:{port}", "-sTCP:LISTEN"],
+                                    capture_output=True, text=True)
+        except OSError:
+            return None
+        pids = {int(pid) for pid in result.stdout.split()}
+        if pids:
+            listeners[port] = pids
+    return listeners
+
+def listening_pids(ports):
+    """{port: pids} of the processes listening on any of ports, or None when
+    neither psutil nor lsof can list sockets"""
+    ports = set(ports)
+    if psutil is not None:
+        # One sweep over the socket table instead of an lsof per port
+        try:
+            listeners = {}
+            for conn in psutil.net_connections(kind='inet'):
+                if conn.status == psutil.CONN_LISTEN and conn.pid and conn.laddr.port in ports:
+                    listeners.setdefault(conn.laddr.port, set()).add(conn.pid)
+            return listeners
+        except psutil.AccessDenied:
+            # macOS only lets root list other processes' sockets
+            pass
+    return _lsof_listeners(ports)
+
+def free_ports(ports):
+    """Kill every process listening on ports
+
+    Returns a (port, pid, error) tuple per process found, error being None
+    when the kill succeeded and the OSError otherwise; None when the
+    listening sockets can't be listed.
+    """
+    listeners = listening_pids(ports)
+    if listeners is None:
+        return None
+    outcomes = []
+    for port, pids in sorted(listeners.items()):
+        for pid in sorted(pids):
+            try:
+                os.kill(pid, signal.SIGKILL)
+                outcomes.append((port, pid, None))
+            except ProcessLookupError:
+                pass
+            except OSError as e:
+                outcomes.append((port, pid, e))
+    return outcomes
+
+def kill_port_processes(ports=PORTS):
     """Kill all processes on commonly used ports"""
-    ports = [5001, 8080, 3000, 5002, 5003, 8000, 8888]
-    
     print("🧹 Cleaning up ports for Chest X-Ray Analysis System...")
     print("=" * 50)
     
-    killed_any = False
-    
+    outcomes = free_ports(ports)
+    if outcomes is None:
+        print("❌ 'lsof' command not found. Install it or run on macOS/Linux")
+        return False
+    busy = {port for port, _, _ in outcomes}
     for port in ports:
-        try:
-            # Find processes using the port
-            result = subprocess.run(
-                ["lsof", "-ti", f":{port}"], 
-                capture_output=True, 
-                text=True
-            )
-            
-            if result.stdout.strip():
-                pids = result.stdout.strip().split('\n')
-                for pid in pids:
-                    if pid:
-                        try:
-                            # Get process info before killing
-                            proc_info = subprocess.run(
-                                ["ps", "-p", pid, "-o", "comm="],
-                                capture_output=True,
-                                text=True
-                            )
-                            
-                            process_name = proc_info.stdout.strip() if proc_info.stdout else "unknown"
-                            
-                            # Kill the process
-                            subprocess.run(["kill", "-9", pid], stderr=subprocess.DEVNULL)
-                            print(f"🔴 Killed process {pid} ({process_name}) on port {port}")
-                            killed_any = True
-                            
-                        except Exception as e:
-                            print(f"⚠️  Failed to kill process {pid}: {e}")
-            else:
-                print(f"✅ Port {port} is free")
-                
-        except FileNotFoundError:
-            print("❌ 'lsof' command not found. Install it or run on macOS/Linux")
-            return False
-        except Exception as e:
-            print(f"⚠️  Error checking port {port}: {e}")
+        if port not in busy:
+            print(f"✅ Port {port} is free")
+    
+    for port, pid, error in outcomes:
+        if error is None:
+            print(f"🔴 Killed process {pid} on port {port}")
+        else:
+            print(f"⚠️  Failed to kill process {pid}: {error}")
     
-    if not killed_any:
+    if not outcomes:
         print("\n🎉 All ports were already free!")
     else:
         print(f"\n✅ Port cleanup completed!")
     
-    return True
+    return all(error is None for _, _, error in outcomes)
 
 def main():
     """Main function"""
@@ -0,0 +1,36 @@
+#!/usr/bin/env python3
+"""
+One-time conversion of legacy HDF5 models to the faster-loading .keras format
+
+Usage (from deep-learning/):
+    python3 convert_model.py                             # densenet.hdf5 -> densenet.keras + densenet_sm/
+    python3 convert_model.py ../chest_xray_model.h5      # -> ../chest_xray_model.keras
+"""
+
+import os
+import sys
+from tensorflow.keras.models import load_model
+
+def convert(hdf5_path):
+    """Save an HDF5 model next to itself in the .keras format"""
+    keras_path = os.path.splitext(hdf5_path)[0] + '.keras'
+    model = load_model(hdf5_path, compile=False)
+    model.save(keras_path)
+    print(f"✅ {hdf5_path} -> {keras_path}")
+    return keras_path
+
+def main():
+    paths = sys.argv[1:] or ['densenet.hdf5']
+    for path in paths:
+        if not os.path.exists(path):
+            print(f"❌ Model file not found: {path}")
+            continue
+        convert(path)
+        
+        if os.path.basename(path) == 'densenet.hdf5':
+            # Inference-only loaders skip Keras layer reconstruction entirely
+            from simple_diagnosis import convert_to_saved_model
+            print(f"✅ {path} -> {convert_to_saved_model(path)}/")
+
+if __name__ == "__main__":
+    main()
@@ -8,24 +8,32 @@ import sys
 import time
 import webbrowser
 import os
-from threading import Timer
+import socket
+from concurrent.futures import ThreadPoolExecutor
+from importlib.util import find_spec
+from cleanup_ports import free_ports
+
+# Import name -> pip package for the backend's Python dependencies
+REQUIRED_PACKAGES = {
+    'flask': 'flask',
+    'flask_cors': 'flask-cors',
+    'numpy': 'numpy',
+    'cv2': 'opencv-python',
+    'PIL': 'pillow',
+}
 
 def check_dependencies():
     """Check if required dependencies are installed"""
     print("🔍 Checking dependencies...")
     
-    # Check Python packages
-    try:
-        import flask
-        import flask_cors
-        import numpy
-        import cv2
-        import PIL
+    # Check Python packages (find_spec locates them without importing numpy/cv2)
+    missing = [pip_name for module, pip_name in REQUIRED_PACKAGES.items() if find_spec(module) is None]
+    if not missing:
         print("✅ Python dependencies found")
-    except ImportError as e:
-        print(f"❌ Missing Python package: {e}")
+    else:
+        print(f"❌ Missing Python packages: {', '.join(missing)}")
         print("Installing required packages...")
-        subprocess.run([sys.executable, "-m", "pip", "install", "flask", "flask-cors", "numpy", "opencv-python", "pillow"])
+        subprocess.run([sys.executable, "-m", "pip", "install", *missing])
     
     # Check Node.js
     try:
@@ -59,10 +67,7 @@ def start_backend():
     """Start the Flask backend"""
     print("🔧 Starting Flask API server...")
     try:
-        process = subprocess.Popen([sys.executable, "backend_api.py"])
-        time.sleep(3)  # Wait for server to start
-        print("✅ API server started on http://localhost:5001")
-        return process
+        return subprocess.Popen([sys.executable, "backend_api.py"])
     except Exception as e:
         print(f"❌ Failed to start backend: {e}")
         return None
@@ -71,17 +76,24 @@ def start_frontend():
     """Start the React frontend"""
     print("🎨 Starting React frontend...")
     try:
-        process = subprocess.Popen(["npm", "start"])
-        time.sleep(8)  # Wait for React to compile and start
-        print("✅ Frontend started on http://localhost:3000")
-        return process
+        return subprocess.Popen(["npm", "start"])
     except Exception as e:
         print(f"❌ Failed to start frontend: {e}")
         return None
 
+def wait_port(port, timeout=15):
+    """Poll until something accepts TCP connections on localhost:port"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), 0.1).close()
+            return True
+        except OSError:
+            time.sleep(0.05)
+    return False
+
 def open_browser():
-    """Open browser after delay"""
-    time.sleep(2)
+    """Open the frontend in a browser"""
     try:
         webbrowser.open("http://localhost:3000")
         print("🌐 Browser opened automatically")
@@ -90,24 +102,8 @@ def open_browser():
 
 def kill_ports():
     """Kill processes on common ports"""
-    import subprocess
-    
-    ports = [5001, 8080, 3000, 5002, 5003]
     print("🧹 Cleaning up ports...")
-    
-    for port in ports:
-        try:
-            result = subprocess.run(["lsof", "-ti", f":{port}"], 
-                                  capture_output=True, text=True)
-            if result.stdout.strip():
-                pids = result.stdout.strip().split('\n')
-                for pid in pids:
-                    if pid:
-                        subprocess.run(["kill", "-9", pid], 
-                                     stderr=subprocess.DEVNULL)
-        except:
-            pass
-    
+    free_ports({5001, 8080, 3000, 5002, 5003})
     print("✅ Ports cleaned")
 
 def main():
@@ -143,8 +139,21 @@ def main():
         backend_process.terminate()
         return
     
-    # Open browser after delay
-    Timer(3.0, open_browser).start()
+    # Both servers boot concurrently; probe their ports instead of sleeping
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        backend_ready = executor.submit(wait_port, 5001)
+        frontend_ready = executor.submit(wait_port, 3000, 60)  # React compiles first
+        
+        if backend_ready.result():
+            print("✅ API server started on http://localhost:5001")
+        else:
+            print("⚠️  API server not answering on port 5001 yet")
+        
+        if frontend_ready.result():
+            print("✅ Frontend started on http://localhost:3000")
+            open_browser()
+        else:
+            print("⚠️  Frontend not answering on port 3000 yet")
     
     print()
     print("🚀 System is ready!")
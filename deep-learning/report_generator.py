@@ -3,17 +3,253 @@
 PDF Report Generator with Charts for Chest X-Ray Analysis
 """
 
-import matplotlib.pyplot as plt
-import matplotlib.patches as patches
-from matplotlib.backends.backend_pdf import PdfPages
 import numpy as np
 import base64
 from io import BytesIO
 from datetime import datetime
 import os
+import threading
+import hashlib
+from collections import OrderedDict
+from dataclasses import dataclass
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 
-# Set matplotlib to use non-interactive backend
-plt.switch_backend('Agg')
+# matplotlib is imported on first chart, so API-only workers never load it
+plt = None
+_matplotlib_lock = threading.Lock()
+
+# Charts are embedded at about 6x4 inches, so 150 dpi is already full resolution
+CHART_DPI = 150
+
+# Worker processes for rendering the four charts in parallel. 0 (the default)
+# renders in-process; spawned workers re-import the launching script, so only
+# raise it when that script is cheap to import
+CHART_WORKERS = int(os.environ.get('CHART_WORKERS', 0))
+
+# Rendered chart sets kept per distinct results (0 disables the cache)
+CHART_CACHE_SIZE = int(os.environ.get('CHART_CACHE_SIZE', 64))
+
+SEVERITY_LEVELS = ('High', 'Medium', 'Low')
+SEVERITY_INDEX = {level: i for i, level in enumerate(SEVERITY_LEVELS)}
+
+@dataclass
+class _Prepared:
+    """Per-condition fields pulled out of the results once per report"""
+    diseases: list
+    probs: np.ndarray      # raw probabilities
+    percent: np.ndarray    # probabilities in %
+    detected: np.ndarray   # bool mask
+    sev: np.ndarray        # index into SEVERITY_LEVELS
+    severity: list
+    confidence: list
+    
+    def chart_key(self, dpi):
+        """Digest of everything the charts draw; probabilities are rounded to 3 decimals,
+        below what the charts can show, so near-identical results share an entry"""
+        digest = hashlib.sha1(repr((self.diseases, dpi)).encode())
+        digest.update(np.round(self.probs, 3).tobytes())
+        digest.update(self.detected.tobytes())
+        digest.update(self.sev.tobytes())
+        return digest.digest()
+    
+    @classmethod
+    def from_results(cls, results):
+        n = len(results)
+        probs = np.fromiter((r['probability'] for r in results), dtype=np.float64, count=n)
+        severity = [r['severity'] for r in results]
+        return cls(
+            diseases=[r['disease'] for r in results],
+            probs=probs,
+            percent=probs * 100,
+            detected=np.fromiter((r['detected'] for r in results), dtype=bool, count=n),
+            sev=np.fromiter((SEVERITY_INDEX[s] for s in severity), dtype=np.intp, count=n),
+            severity=severity,
+            confidence=[r['confidence'] for r in results],
+        )
+
+# Chart figures are built once per process and redrawn for each report.
+# Constrained layout is solved during the savefig draw, with no separate layout pass
+_FIGURE_FACTORIES = {
+    'bar': lambda: plt.subplots(figsize=(12, 10), layout='constrained'),
+    'pie': lambda: plt.subplots(figsize=(10, 8), layout='constrained'),
+    'radar': lambda: plt.subplots(figsize=(10, 10), layout='constrained', subplot_kw=dict(projection='polar')),
+    'severity': lambda: plt.subplots(1, 2, figsize=(15, 6), layout='constrained'),
+}
+_figures = {}
+# pyplot state is global, so in-process rendering is serialized
+_figure_lock = threading.Lock()
+
+_chart_executor = None
+_chart_executor_lock = threading.Lock()
+
+def get_chart_executor():
+    """Shared process pool for chart rendering (None when CHART_WORKERS is 0)"""
+    global _chart_executor
+    with _chart_executor_lock:
+        if _chart_executor is None and CHART_WORKERS > 0:
+            # spawn rather than fork: the parent may hold matplotlib/TF threads and locks
+            _chart_executor = ProcessPoolExecutor(max_workers=CHART_WORKERS,
+                                                  mp_context=multiprocessing.get_context('spawn'))
+    return _chart_executor
+
+def _load_matplotlib():
+    """Import pyplot with the non-interactive Agg backend, once per process"""
+    global plt
+    with _matplotlib_lock:
+        if plt is None:
+            import matplotlib
+            matplotlib.use('Agg')
+            import matplotlib.pyplot as pyplot
+            plt = pyplot
+    return plt
+
+def _get_figure(key):
+    """Return this process's figure and axes for a chart, cleared for redrawing"""
+    _load_matplotlib()
+    if key not in _figures:
+        _figures[key] = _FIGURE_FACTORIES[key]()
+    fig, axes = _figures[key]
+    for ax in np.atleast_1d(axes):
+        ax.clear()
+    return fig, axes
+
+def _render_bar_chart(prep, palette, dpi=CHART_DPI):
+    """Create horizontal bar chart of all conditions"""
+    fig, ax = _get_figure('bar')
+    
+    diseases = prep.diseases
+    probabilities = prep.percent
+    colors = np.where(prep.detected, palette['detected'], palette['clear'])
+    
+    bars = ax.barh(diseases, probabilities, color=colors, alpha=0.8, edgecolor='white', linewidth=1)
+    
+    # Add percentage labels
+    ax.bar_label(bars, labels=[f'{p:.1f}%' for p in probabilities], padding=3,
+                 fontweight='bold', fontsize=9)
+    
+    ax.set_xlabel('Probability (%)', fontsize=12, fontweight='bold')
+    ax.set_title('Chest X-Ray Analysis - All Conditions', fontsize=16, fontweight='bold', pad=20)
+    ax.set_xlim(0, 100)
+    
+    # Add threshold line
+    ax.axvline(x=50, color='red', linestyle='--', alpha=0.7, linewidth=2, label='Detection Threshold (50%)')
+    ax.legend()
+    
+    # Styling
+    ax.grid(axis='x', alpha=0.3)
+    ax.set_facecolor(palette['background'])
+    
+    return _fig_to_png_bytes(fig, dpi)
+
+def _render_pie_chart(prep, palette, dpi=CHART_DPI):
+    """Create pie chart showing detected vs clear conditions"""
+    fig, ax = _get_figure('pie')
+    
+    detected_count = int(np.count_nonzero(prep.detected))
+    clear_count = len(prep.detected) - detected_count
+    
+    sizes = [detected_count, clear_count]
+    labels = [f'Detected\n({detected_count} conditions)', f'Clear\n({clear_count} conditions)']
+    colors = [palette['detected'], palette['clear']]
+    explode = (0.1, 0) if detected_count > 0 else (0, 0)
+    
+    wedges, texts, autotexts = ax.pie(sizes, labels=labels, colors=colors, autopct='%1.1f%%',
+                                     startangle=90, explode=explode, shadow=True,
+                                     textprops={'fontsize': 12, 'fontweight': 'bold'})
+    
+    ax.set_title('Detection Summary', fontsize=16, fontweight='bold', pad=20)
+    
+    # Equal aspect ratio ensures that pie is drawn as a circle
+    ax.axis('equal')
+    
+    return _fig_to_png_bytes(fig, dpi)
+
+def _render_radar_chart(prep, palette, dpi=CHART_DPI):
+    """Create radar chart for top conditions"""
+    fig, ax = _get_figure('radar')
+    
+    # Top 8 for readability
+    diseases = prep.diseases[:8]
+    probabilities = prep.percent[:8]
+    
+    # Number of variables
+    N = len(diseases)
+    
+    # Compute angle for each axis, repeating the first to complete the circle
+    angles = np.linspace(0, 2 * np.pi, N, endpoint=False)
+    angles = np.concatenate([angles, angles[:1]])
+    
+    # Add values
+    probabilities = np.concatenate([probabilities, probabilities[:1]])  # Complete the circle
+    
+    # Plot
+    ax.plot(angles, probabilities, 'o-', linewidth=2, color=palette['accent'])
+    ax.fill(angles, probabilities, alpha=0.25, color=palette['accent'])
+    
+    # Add labels
+    ax.set_xticks(angles[:-1])
+    ax.set_xticklabels(diseases, fontsize=10)
+    ax.set_ylim(0, 100)
+    ax.set_yticks([20, 40, 60, 80, 100])
+    ax.set_yticklabels(['20%', '40%', '60%', '80%', '100%'])
+    ax.grid(True)
+    
+    ax.set_title('Top Conditions - Radar View', fontsize=16, fontweight='bold', pad=30)
+    
+    return _fig_to_png_bytes(fig, dpi)
+
+def _render_severity_chart(prep, palette, dpi=CHART_DPI):
+    """Create severity distribution chart"""
+    fig, (ax1, ax2) = _get_figure('severity')
+    
+    # Bar chart of severity distribution
+    severities = list(SEVERITY_LEVELS)
+    counts = np.bincount(prep.sev, minlength=len(SEVERITY_LEVELS)).tolist()
+    colors_sev = ['#e74c3c', '#f39c12', '#27ae60']
+    
+    bars = ax1.bar(severities, counts, color=colors_sev, alpha=0.8, edgecolor='white', linewidth=2)
+    ax1.set_title('Severity Distribution', fontsize=14, fontweight='bold')
+    ax1.set_ylabel('Number of Conditions', fontweight='bold')
+    
+    # Add count labels on bars
+    ax1.bar_label(bars, padding=3, fontweight='bold')
+    
+    # Confidence distribution histogram
+    ax2.hist(prep.percent, bins=10, color=palette['accent'], alpha=0.7, edgecolor='white', linewidth=1)
+    ax2.set_title('Confidence Distribution', fontsize=14, fontweight='bold')
+    ax2.set_xlabel('Confidence (%)', fontweight='bold')
+    ax2.set_ylabel('Number of Conditions', fontweight='bold')
+    ax2.axvline(x=50, color='red', linestyle='--', alpha=0.7, linewidth=2, label='Threshold')
+    ax2.legend()
+    
+    return _fig_to_png_bytes(fig, dpi)
+
+def _fig_to_png_bytes(fig, dpi=CHART_DPI):
+    """Render matplotlib figure to a PNG BytesIO positioned at the start"""
+    buffer = BytesIO()
+    fig.savefig(buffer, format='png', dpi=dpi, bbox_inches='tight', 
+               facecolor='white', edgecolor='none')
+    buffer.seek(0)
+    return buffer
+
+_chart_cache = OrderedDict()
+_chart_cache_lock = threading.Lock()
+
+def _cached_charts(key):
+    """PNG bytes per chart for a chart_key, or None; refreshes the entry's LRU position"""
+    with _chart_cache_lock:
+        charts = _chart_cache.get(key)
+        if charts is not None:
+            _chart_cache.move_to_end(key)
+        return charts
+
+def _cache_charts(key, charts):
+    with _chart_cache_lock:
+        _chart_cache[key] = charts
+        _chart_cache.move_to_end(key)
+        while len(_chart_cache) > CHART_CACHE_SIZE:
+            _chart_cache.popitem(last=False)
 
 class XRayReportGenerator:
     def __init__(self):
@@ -25,196 +261,142 @@ class XRayReportGenerator:
             'accent': '#3498db'
         }
         
-    def create_analysis_charts(self, results, detected_conditions):
-        """Create various charts for the analysis"""
-        charts = {}
-        
-        # 1. Horizontal Bar Chart - All Conditions
-        charts['bar_chart'] = self._create_bar_chart(results)
-        
-        # 2. Pie Chart - Detected vs Clear
-        charts['pie_chart'] = self._create_pie_chart(results)
-        
-        # 3. Radar Chart - Top Conditions
-        charts['radar_chart'] = self._create_radar_chart(results[:8])  # Top 8 for readability
-        
-        # 4. Severity Distribution
-        charts['severity_chart'] = self._create_severity_chart(results)
-        
-        return charts
-    
-    def _create_bar_chart(self, results):
-        """Create horizontal bar chart of all conditions"""
-        fig, ax = plt.subplots(figsize=(12, 10))
-        
-        diseases = [r['disease'] for r in results]
-        probabilities = [r['probability'] * 100 for r in results]
-        colors = [self.colors['detected'] if r['detected'] else self.colors['clear'] for r in results]
+        # ReportLab styles, built on first PDF
+        self._styles = None
+        self._title_style = None
+        self._heading_style = None
+        self._info_table_style = None
+        self._detected_table_style = None
+        self._results_table_style = None
         
-        bars = ax.barh(diseases, probabilities, color=colors, alpha=0.8, edgecolor='white', linewidth=1)
-        
-        # Add percentage labels
-        for i, (bar, prob) in enumerate(zip(bars, probabilities)):
-            ax.text(prob + 1, bar.get_y() + bar.get_height()/2, 
-                   f'{prob:.1f}%', va='center', fontweight='bold', fontsize=9)
-        
-        ax.set_xlabel('Probability (%)', fontsize=12, fontweight='bold')
-        ax.set_title('Chest X-Ray Analysis - All Conditions', fontsize=16, fontweight='bold', pad=20)
-        ax.set_xlim(0, 100)
-        
-        # Add threshold line
-        ax.axvline(x=50, color='red', linestyle='--', alpha=0.7, linewidth=2, label='Detection Threshold (50%)')
-        ax.legend()
-        
-        # Styling
-        ax.grid(axis='x', alpha=0.3)
-        ax.set_facecolor(self.colors['background'])
-        plt.tight_layout()
-        
-        return self._fig_to_base64(fig)
+    def create_analysis_charts(self, results, detected_conditions, dpi=CHART_DPI, as_base64=True, prep=None):
+        """Create various charts for the analysis
+
+        Returns base64 PNG strings, or the PNG BytesIO buffers with as_base64=False.
+        """
+        if prep is None:
+            prep = _Prepared.from_results(results)
+        
+        key = prep.chart_key(dpi) if CHART_CACHE_SIZE > 0 else None
+        pngs = _cached_charts(key) if key is not None else None
+        if pngs is None:
+            pngs = {name: buffer.getvalue() for name, buffer in self._render_charts(prep, dpi).items()}
+            if key is not None:
+                _cache_charts(key, pngs)
+        
+        if as_base64:
+            return {name: base64.b64encode(png).decode() for name, png in pngs.items()}
+        return {name: BytesIO(png) for name, png in pngs.items()}
     
-    def _create_pie_chart(self, results):
-        """Create pie chart showing detected vs clear conditions"""
-        fig, ax = plt.subplots(figsize=(10, 8))
-        
-        detected_count = len([r for r in results if r['detected']])
-        clear_count = len(results) - detected_count
-        
-        sizes = [detected_count, clear_count]
-        labels = [f'Detected\n({detected_count} conditions)', f'Clear\n({clear_count} conditions)']
-        colors = [self.colors['detected'], self.colors['clear']]
-        explode = (0.1, 0) if detected_count > 0 else (0, 0)
-        
-        wedges, texts, autotexts = ax.pie(sizes, labels=labels, colors=colors, autopct='%1.1f%%',
-                                         startangle=90, explode=explode, shadow=True,
-                                         textprops={'fontsize': 12, 'fontweight': 'bold'})
-        
-        ax.set_title('Detection Summary', fontsize=16, fontweight='bold', pad=20)
-        
-        # Equal aspect ratio ensures that pie is drawn as a circle
-        ax.axis('equal')
+    def _render_charts(self, prep, dpi):
+        """Render all four charts with matplotlib, in the chart worker pool when there is one"""
+        jobs = {
+            # 1. Horizontal Bar Chart - All Conditions
+            'bar_chart': _render_bar_chart,
+            # 2. Pie Chart - Detected vs Clear
+            'pie_chart': _render_pie_chart,
+            # 3. Radar Chart - Top Conditions
+            'radar_chart': _render_radar_chart,
+            # 4. Severity Distribution
+            'severity_chart': _render_severity_chart,
+        }
         
-        return self._fig_to_base64(fig)
+        executor = get_chart_executor()
+        if executor is None:
+            with _figure_lock:
+                charts = {key: render(prep, self.colors, dpi) for key, render in jobs.items()}
+        else:
+            futures = {key: executor.submit(render, prep, self.colors, dpi)
+                       for key, render in jobs.items()}
+            charts = {key: future.result() for key, future in futures.items()}
+        return charts
     
-    def _create_radar_chart(self, top_results):
-        """Create radar chart for top conditions"""
-        fig, ax = plt.subplots(figsize=(10, 10), subplot_kw=dict(projection='polar'))
-        
-        diseases = [r['disease'] for r in top_results]
-        probabilities = [r['probability'] * 100 for r in top_results]
-        
-        # Number of variables
-        N = len(diseases)
-        
-        # Compute angle for each axis
-        angles = [n / float(N) * 2 * np.pi for n in range(N)]
-        angles += angles[:1]  # Complete the circle
-        
-        # Add values
-        probabilities += probabilities[:1]  # Complete the circle
-        
-        # Plot
-        ax.plot(angles, probabilities, 'o-', linewidth=2, color=self.colors['accent'])
-        ax.fill(angles, probabilities, alpha=0.25, color=self.colors['accent'])
-        
-        # Add labels
-        ax.set_xticks(angles[:-1])
-        ax.set_xticklabels(diseases, fontsize=10)
-        ax.set_ylim(0, 100)
-        ax.set_yticks([20, 40, 60, 80, 100])
-        ax.set_yticklabels(['20%', '40%', '60%', '80%', '100%'])
-        ax.grid(True)
-        
-        ax.set_title('Top Conditions - Radar View', fontsize=16, fontweight='bold', pad=30)
-        
-        return self._fig_to_base64(fig)
+    def _init_pdf_styles(self):
+        """Build the ReportLab paragraph and table styles once; they're reused by every report"""
+        from reportlab.platypus import TableStyle
+        from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+        from reportlab.lib import colors as rl_colors
+        from reportlab.lib.enums import TA_CENTER
+        
+        self._styles = getSampleStyleSheet()
+        
+        # Custom styles
+        self._title_style = ParagraphStyle(
+            'CustomTitle',
+            parent=self._styles['Heading1'],
+            fontSize=24,
+            spaceAfter=30,
+            alignment=TA_CENTER,
+            textColor=rl_colors.HexColor('#2c3e50')
+        )
+        
+        self._heading_style = ParagraphStyle(
+            'CustomHeading',
+            parent=self._styles['Heading2'],
+            fontSize=16,
+            spaceAfter=12,
+            textColor=rl_colors.HexColor('#3498db')
+        )
+        
+        self._info_table_style = TableStyle([
+            ('BACKGROUND', (0, 0), (0, -1), rl_colors.HexColor('#ecf0f1')),
+            ('TEXTCOLOR', (0, 0), (-1, -1), rl_colors.black),
+            ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+            ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
+            ('FONTSIZE', (0, 0), (-1, -1), 10),
+            ('GRID', (0, 0), (-1, -1), 1, rl_colors.black),
+            ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+        ])
+        
+        self._detected_table_style = TableStyle([
+            ('BACKGROUND', (0, 0), (-1, 0), rl_colors.HexColor('#e74c3c')),
+            ('TEXTCOLOR', (0, 0), (-1, 0), rl_colors.whitesmoke),
+            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+            ('FONTSIZE', (0, 0), (-1, -1), 9),
+            ('GRID', (0, 0), (-1, -1), 1, rl_colors.black),
+            ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+            ('BACKGROUND', (0, 1), (-1, -1), rl_colors.HexColor('#fdf2f2')),
+        ])
+        
+        self._results_table_style = TableStyle([
+            ('BACKGROUND', (0, 0), (-1, 0), rl_colors.HexColor('#3498db')),
+            ('TEXTCOLOR', (0, 0), (-1, 0), rl_colors.whitesmoke),
+            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+            ('FONTSIZE', (0, 0), (-1, -1), 8),
+            ('GRID', (0, 0), (-1, -1), 1, rl_colors.black),
+            ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+        ])
     
-    def _create_severity_chart(self, results):
-        """Create severity distribution chart"""
-        fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(15, 6))
-        
-        # Severity counts
-        severity_counts = {'High': 0, 'Medium': 0, 'Low': 0}
-        for r in results:
-            severity_counts[r['severity']] += 1
-        
-        # Bar chart of severity distribution
-        severities = list(severity_counts.keys())
-        counts = list(severity_counts.values())
-        colors_sev = ['#e74c3c', '#f39c12', '#27ae60']
-        
-        bars = ax1.bar(severities, counts, color=colors_sev, alpha=0.8, edgecolor='white', linewidth=2)
-        ax1.set_title('Severity Distribution', fontsize=14, fontweight='bold')
-        ax1.set_ylabel('Number of Conditions', fontweight='bold')
-        
-        # Add count labels on bars
-        for bar, count in zip(bars, counts):
-            ax1.text(bar.get_x() + bar.get_width()/2, bar.get_height() + 0.1,
-                    str(count), ha='center', va='bottom', fontweight='bold')
-        
-        # Confidence distribution histogram
-        confidences = [r['probability'] * 100 for r in results]
-        ax2.hist(confidences, bins=10, color=self.colors['accent'], alpha=0.7, edgecolor='white', linewidth=1)
-        ax2.set_title('Confidence Distribution', fontsize=14, fontweight='bold')
-        ax2.set_xlabel('Confidence (%)', fontweight='bold')
-        ax2.set_ylabel('Number of Conditions', fontweight='bold')
-        ax2.axvline(x=50, color='red', linestyle='--', alpha=0.7, linewidth=2, label='Threshold')
-        ax2.legend()
-        
-        plt.tight_layout()
-        return self._fig_to_base64(fig)
-    
-    def _fig_to_base64(self, fig):
-        """Convert matplotlib figure to base64 string"""
-        buffer = BytesIO()
-        fig.savefig(buffer, format='png', dpi=300, bbox_inches='tight', 
-                   facecolor='white', edgecolor='none')
-        buffer.seek(0)
-        image_base64 = base64.b64encode(buffer.getvalue()).decode()
-        plt.close(fig)
-        return image_base64
-    
-    def generate_pdf_report(self, analysis_data, patient_info=None):
-        """Generate comprehensive PDF report"""
+    def generate_pdf_report(self, analysis_data, patient_info=None, output=None):
+        """Generate comprehensive PDF report
+
+        With output (a writable binary file-like) the PDF is written straight
+        into it and output is returned; otherwise the PDF bytes are returned.
+        """
         try:
-            from reportlab.lib.pagesizes import letter, A4
+            from reportlab.lib.pagesizes import A4
             from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Image, Table, TableStyle, PageBreak
-            from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
             from reportlab.lib.units import inch
             from reportlab.lib import colors as rl_colors
-            from reportlab.lib.enums import TA_CENTER, TA_LEFT, TA_RIGHT
             
-            # Create PDF buffer
-            buffer = BytesIO()
+            # Write to the caller's sink, or to our own buffer
+            buffer = BytesIO() if output is None else output
             doc = SimpleDocTemplate(buffer, pagesize=A4, rightMargin=72, leftMargin=72,
                                   topMargin=72, bottomMargin=18)
             
-            # Get styles
-            styles = getSampleStyleSheet()
-            
-            # Custom styles
-            title_style = ParagraphStyle(
-                'CustomTitle',
-                parent=styles['Heading1'],
-                fontSize=24,
-                spaceAfter=30,
-                alignment=TA_CENTER,
-                textColor=rl_colors.HexColor('#2c3e50')
-            )
-            
-            heading_style = ParagraphStyle(
-                'CustomHeading',
-                parent=styles['Heading2'],
-                fontSize=16,
-                spaceAfter=12,
-                textColor=rl_colors.HexColor('#3498db')
-            )
+            if self._results_table_style is None:  # assigned last in _init_pdf_styles
+                self._init_pdf_styles()
+            
+            # Per-condition arrays shared by the results table and the charts
+            prep = _Prepared.from_results(analysis_data.get('results', []))
             
             # Story container
             story = []
             
             # Title
-            story.append(Paragraph("🏥 CHEST X-RAY ANALYSIS REPORT", title_style))
+            story.append(Paragraph("🏥 CHEST X-RAY ANALYSIS REPORT", self._title_style))
             story.append(Spacer(1, 20))
             
             # Patient/Analysis Info
@@ -230,38 +412,32 @@ class XRayReportGenerator:
                 info_data.insert(1, ['Patient Name:', patient_info.get('name', 'N/A')])
             
             info_table = Table(info_data, colWidths=[2*inch, 3*inch])
-            info_table.setStyle(TableStyle([
-                ('BACKGROUND', (0, 0), (0, -1), rl_colors.HexColor('#ecf0f1')),
-                ('TEXTCOLOR', (0, 0), (-1, -1), rl_colors.black),
-                ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-                ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
-                ('FONTSIZE', (0, 0), (-1, -1), 10),
-                ('GRID', (0, 0), (-1, -1), 1, rl_colors.black),
-                ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
-            ]))
+            info_table.setStyle(self._info_table_style)
             
             story.append(info_table)
             story.append(Spacer(1, 30))
             
             # Summary
             summary = analysis_data.get('summary', {})
-            story.append(Paragraph("📊 ANALYSIS SUMMARY", heading_style))
+            # highest_probability is None when there were no results
+            highest = summary.get('highest_probability') or {}
+            story.append(Paragraph("📊 ANALYSIS SUMMARY", self._heading_style))
             
             summary_text = f"""
             <b>Overall Status:</b> {summary.get('status', 'Unknown')}<br/>
             <b>Total Conditions Checked:</b> {analysis_data.get('total_conditions_checked', 0)}<br/>
             <b>Conditions Detected:</b> {summary.get('detected_count', 0)}<br/>
-            <b>Highest Probability:</b> {summary.get('highest_probability', {}).get('disease', 'N/A')} 
-            ({summary.get('highest_probability', {}).get('confidence', 'N/A')})
+            <b>Highest Probability:</b> {highest.get('disease', 'N/A')} 
+            ({highest.get('confidence', 'N/A')})
             """
             
-            story.append(Paragraph(summary_text, styles['Normal']))
+            story.append(Paragraph(summary_text, self._styles['Normal']))
             story.append(Spacer(1, 20))
             
             # Detected Conditions Table
             detected = analysis_data.get('detected_conditions', [])
             if detected:
-                story.append(Paragraph("🚨 DETECTED CONDITIONS", heading_style))
+                story.append(Paragraph("🚨 DETECTED CONDITIONS", self._heading_style))
                 
                 detected_data = [['Condition', 'Probability', 'Confidence', 'Severity']]
                 for condition in detected:
@@ -273,66 +449,41 @@ class XRayReportGenerator:
                     ])
                 
                 detected_table = Table(detected_data, colWidths=[2*inch, 1*inch, 1*inch, 1*inch])
-                detected_table.setStyle(TableStyle([
-                    ('BACKGROUND', (0, 0), (-1, 0), rl_colors.HexColor('#e74c3c')),
-                    ('TEXTCOLOR', (0, 0), (-1, 0), rl_colors.whitesmoke),
-                    ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-                    ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-                    ('FONTSIZE', (0, 0), (-1, -1), 9),
-                    ('GRID', (0, 0), (-1, -1), 1, rl_colors.black),
-                    ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
-                    ('BACKGROUND', (0, 1), (-1, -1), rl_colors.HexColor('#fdf2f2')),
-                ]))
+                detected_table.setStyle(self._detected_table_style)
                 
                 story.append(detected_table)
                 story.append(Spacer(1, 20))
             
             # Complete Results Table
-            story.append(Paragraph("📋 COMPLETE ANALYSIS RESULTS", heading_style))
+            story.append(Paragraph("📋 COMPLETE ANALYSIS RESULTS", self._heading_style))
             
             results_data = [['Condition', 'Probability', 'Confidence', 'Status', 'Severity']]
-            for result in analysis_data.get('results', []):
-                status = 'DETECTED' if result['detected'] else 'CLEAR'
-                results_data.append([
-                    result['disease'],
-                    f"{result['probability']:.3f}",
-                    result['confidence'],
-                    status,
-                    result['severity']
-                ])
+            # Row colors by detection, collected here and applied with one setStyle
+            detected_bg = rl_colors.HexColor('#fdf2f2')
+            clear_bg = rl_colors.HexColor('#f2fdf2')
+            results_data += [
+                [disease, f"{p:.3f}", confidence, 'DETECTED' if detected else 'CLEAR', severity]
+                for disease, p, confidence, detected, severity in zip(
+                    prep.diseases, prep.probs.tolist(), prep.confidence, prep.detected.tolist(), prep.severity)
+            ]
+            row_bgs = [('BACKGROUND', (0, i), (-1, i), detected_bg if detected else clear_bg)
+                       for i, detected in enumerate(prep.detected.tolist(), 1)]
             
             results_table = Table(results_data, colWidths=[1.8*inch, 0.8*inch, 0.8*inch, 0.8*inch, 0.8*inch])
-            results_table.setStyle(TableStyle([
-                ('BACKGROUND', (0, 0), (-1, 0), rl_colors.HexColor('#3498db')),
-                ('TEXTCOLOR', (0, 0), (-1, 0), rl_colors.whitesmoke),
-                ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-                ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-                ('FONTSIZE', (0, 0), (-1, -1), 8),
-                ('GRID', (0, 0), (-1, -1), 1, rl_colors.black),
-                ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
-            ]))
-            
-            # Color code rows based on detection
-            for i, result in enumerate(analysis_data.get('results', []), 1):
-                if result['detected']:
-                    results_table.setStyle(TableStyle([
-                        ('BACKGROUND', (0, i), (-1, i), rl_colors.HexColor('#fdf2f2'))
-                    ]))
-                else:
-                    results_table.setStyle(TableStyle([
-                        ('BACKGROUND', (0, i), (-1, i), rl_colors.HexColor('#f2fdf2'))
-                    ]))
+            results_table.setStyle(self._results_table_style)
+            results_table.setStyle(TableStyle(row_bgs))
             
             story.append(results_table)
             story.append(PageBreak())
             
             # Charts Page
-            story.append(Paragraph("📈 VISUAL ANALYSIS", title_style))
+            story.append(Paragraph("📈 VISUAL ANALYSIS", self._title_style))
             story.append(Spacer(1, 20))
             
             # Generate charts
             charts = self.create_analysis_charts(analysis_data.get('results', []), 
-                                               analysis_data.get('detected_conditions', []))
+                                               analysis_data.get('detected_conditions', []),
+                                               as_base64=False, prep=prep)
             
             # Add charts to PDF
             chart_titles = {
@@ -342,19 +493,19 @@ class XRayReportGenerator:
                 'severity_chart': 'Severity and Confidence Distribution'
             }
             
-            for chart_key, chart_base64 in charts.items():
-                if chart_base64:
-                    story.append(Paragraph(chart_titles.get(chart_key, 'Chart'), heading_style))
+            for chart_key, chart_buffer in charts.items():
+                if chart_buffer:
+                    story.append(Paragraph(chart_titles.get(chart_key, 'Chart'), self._heading_style))
                     
-                    # Convert base64 to image
-                    chart_buffer = BytesIO(base64.b64decode(chart_base64))
+                    # ReportLab reads the PNG buffer directly
+                    chart_buffer.seek(0)
                     chart_img = Image(chart_buffer, width=6*inch, height=4*inch)
                     story.append(chart_img)
                     story.append(Spacer(1, 20))
             
             # Medical Disclaimer
             story.append(PageBreak())
-            story.append(Paragraph("⚠️ MEDICAL DISCLAIMER", heading_style))
+            story.append(Paragraph("⚠️ MEDICAL DISCLAIMER", self._heading_style))
             
             disclaimer_text = """
             <b>IMPORTANT NOTICE:</b><br/><br/>
@@ -381,11 +532,14 @@ class XRayReportGenerator:
             proper medical imaging protocols, or comprehensive patient evaluation.
             """
             
-            story.append(Paragraph(disclaimer_text, styles['Normal']))
+            story.append(Paragraph(disclaimer_text, self._styles['Normal']))
             
             # Build PDF
             doc.build(story)
             
+            if output is not None:
+                return output
+            
             # Get PDF data
             pdf_data = buffer.getvalue()
             buffer.close()
@@ -394,7 +548,11 @@ class XRayReportGenerator:
             
         except ImportError:
             # Fallback to simple text report if reportlab not available
-            return self._generate_simple_text_report(analysis_data)
+            report = self._generate_simple_text_report(analysis_data)
+            if output is not None:
+                output.write(report)
+                return output
+            return report
         except Exception as e:
             print(f"Error generating PDF: {e}")
             return None
@@ -437,5 +595,13 @@ DETECTED CONDITIONS:
         
         return report.encode('utf-8')
 
-# Global instance
-report_generator = XRayReportGenerator()
\ No newline at end of file
+_report_generator = None
+_report_generator_lock = threading.Lock()
+
+def get_report_generator():
+    """Shared XRayReportGenerator, created on first use"""
+    global _report_generator
+    with _report_generator_lock:
+        if _report_generator is None:
+            _report_generator = XRayReportGenerator()
+    return _report_generator
\ No newline at end of file
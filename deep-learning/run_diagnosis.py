@@ -5,11 +5,12 @@ Simplified version to run the deep learning model for disease detection
 """
 
 import os
+import sys
 import numpy as np
 import cv2
-import matplotlib.pyplot as plt
+import tensorflow as tf
 from tensorflow.keras.models import load_model
-from tensorflow.keras.applications.densenet import preprocess_input
+from concurrent.futures import ThreadPoolExecutor
 import warnings
 warnings.filterwarnings('ignore')
 
@@ -20,9 +21,191 @@ LABELS = [
     'Nodule', 'Pleural_Thickening', 'Pneumonia', 'Pneumothorax'
 ]
 
+INPUT_SHAPE = (1, 320, 320, 3)
+ONNX_MODEL_PATH = 'densenet.onnx'
+TRT_ENGINE_PATH = 'densenet.int8.plan'
+# Written by build_trt_engine's calibration; an engine without it is not trusted
+TRT_CALIB_CACHE_PATH = 'densenet.int8.calib'
+# DenseNet preprocess_input ('torch' mode) statistics, in the 0-255 pixel range
+DENSENET_MEAN = np.array([123.675, 116.28, 103.53], dtype=np.float32)
+DENSENET_STD = np.array([58.395, 57.12, 57.375], dtype=np.float32)
+
+def build_trt_engine(calib_dir, hdf5_path='densenet.hdf5', engine_path=TRT_ENGINE_PATH,
+                     cache_path=TRT_CALIB_CACHE_PATH):
+    """Export the Keras model to ONNX and build an INT8 TensorRT engine from it
+
+    INT8 needs real activation ranges, so the engine is calibrated on the chest
+    X-rays in calib_dir (a few hundred representative images). The calibration
+    cache is written to cache_path and reused when calib_dir is None.
+    Needs tf2onnx, TensorRT and pycuda; run once on the GPU host:
+    python3 -c "import run_diagnosis as r; r.build_trt_engine('calibration_xrays/')"
+    """
+    import tensorrt as trt
+    import tf2onnx
+    
+    image_paths = sorted(os.path.join(calib_dir, name) for name in os.listdir(calib_dir)) if calib_dir else []
+    if not image_paths and not os.path.exists(cache_path):
+        raise ValueError("INT8 calibration needs chest X-ray images in calib_dir "
+                         f"or an existing calibration cache at {cache_path}")
+    
+    model = load_model(hdf5_path, compile=False)
+    spec = (tf.TensorSpec(INPUT_SHAPE, tf.float32, name='input'),)
+    tf2onnx.convert.from_keras(model, input_signature=spec, opset=13, output_path=ONNX_MODEL_PATH)
+    
+    logger = trt.Logger(trt.Logger.WARNING)
+    builder = trt.Builder(logger)
+    network = builder.create_network(1 << int(trt.NetworkDefinitionCreationFlag.EXPLICIT_BATCH))
+    parser = trt.OnnxParser(network, logger)
+    with open(ONNX_MODEL_PATH, 'rb') as f:
+        if not parser.parse(f.read()):
+            raise RuntimeError(f"Could not parse {ONNX_MODEL_PATH}: {parser.get_error(0)}")
+    
+    config = builder.create_builder_config()
+    config.set_flag(trt.BuilderFlag.INT8)
+    config.set_flag(trt.BuilderFlag.FP16)
+    config.int8_calibrator = make_calibrator(image_paths, cache_path)
+    engine = builder.build_serialized_network(network, config)
+    if engine is None:
+        raise RuntimeError("TensorRT engine build failed")
+    with open(engine_path, 'wb') as f:
+        f.write(engine)
+    return engine_path
+
+def make_calibrator(image_paths, cache_path):
+    """IInt8EntropyCalibrator2 feeding preprocessed X-rays one at a time"""
+    import tensorrt as trt
+    import pycuda.autoinit  # creates the CUDA context
+    import pycuda.driver as cuda
+    
+    class Calibrator(trt.IInt8EntropyCalibrator2):
+        def __init__(self):
+            trt.IInt8EntropyCalibrator2.__init__(self)
+            self.paths = iter(image_paths)
+            self.host = np.empty(INPUT_SHAPE, dtype=np.float32)
+            self.device = cuda.mem_alloc(self.host.nbytes)
+        
+        def get_batch_size(self):
+            return INPUT_SHAPE[0]
+        
+        def get_batch(self, names):
+            for path in self.paths:
+                gray = cv2.imread(path, cv2.IMREAD_GRAYSCALE)
+                if gray is None:
+                    continue
+                gray = cv2.resize(gray, INPUT_SHAPE[2:0:-1], interpolation=cv2.INTER_AREA)
+                np.subtract(gray[..., None], DENSENET_MEAN, out=self.host[0], dtype=np.float32)
+                np.multiply(self.host[0], 1.0 / DENSENET_STD, out=self.host[0])
+                cuda.memcpy_htod(self.device, self.host)
+                return [int(self.device)]
+            return None
+        
+        def read_calibration_cache(self):
+            if os.path.exists(cache_path):
+                with open(cache_path, 'rb') as f:
+                    return f.read()
+            return None
+        
+        def write_calibration_cache(self, cache):
+            with open(cache_path, 'wb') as f:
+                f.write(cache)
+    
+    return Calibrator()
+
+class TRTEngine:
+    """TensorRT engine with its pinned host and device buffers allocated once"""
+    
+    def __init__(self, engine_path):
+        import tensorrt as trt
+        import pycuda.autoinit  # creates the CUDA context
+        import pycuda.driver as cuda
+        
+        self.cuda = cuda
+        with open(engine_path, 'rb') as f:
+            runtime = trt.Runtime(trt.Logger(trt.Logger.WARNING))
+            self.engine = runtime.deserialize_cuda_engine(f.read())
+        self.context = self.engine.create_execution_context()
+        self.stream = cuda.Stream()
+        
+        self.bindings = []
+        for i in range(self.engine.num_bindings):
+            host = cuda.pagelocked_empty(tuple(self.engine.get_binding_shape(i)),
+                                         trt.nptype(self.engine.get_binding_dtype(i)))
+            device = cuda.mem_alloc(host.nbytes)
+            self.bindings.append(int(device))
+            if self.engine.binding_is_input(i):
+                self.host_input, self.device_input = host, device
+            else:
+                self.host_output, self.device_output = host, device
+    
+    def __call__(self, batch):
+        if len(batch) != len(self.host_input):
+            # The engine is built for a fixed batch size; run larger batches through it row by row
+            return np.concatenate([self(batch[i:i + 1]) for i in range(len(batch))], axis=0)
+        np.copyto(self.host_input, batch)
+        return self.run()
+    
+    def run(self):
+        """Infer on whatever is already in the pinned host_input buffer"""
+        self.cuda.memcpy_htod_async(self.device_input, self.host_input, self.stream)
+        self.context.execute_async_v2(self.bindings, self.stream.handle)
+        self.cuda.memcpy_dtoh_async(self.host_output, self.device_output, self.stream)
+        self.stream.synchronize()
+        return self.host_output.copy()
+
+def rank_predictions(probs, k=5):
+    """Indices of the k most probable labels for each row of an (N, labels) array, highest first"""
+    k = min(k, probs.shape[1])
+    top = np.argpartition(-probs, k - 1, axis=1)[:, :k]
+    order = np.argsort(-np.take_along_axis(probs, top, axis=1), axis=1)
+    return np.take_along_axis(top, order, axis=1)
+
+def build_end_to_end(predict, input_shape=INPUT_SHAPE):
+    """Graph that reads, decodes, resizes and normalizes image files, then runs predict
+
+    Keeps the whole preprocess on the TF device path, so the GPU receives the decoded
+    uint8 frames rather than a host-built float32 batch. The file decode itself is a
+    host op; resize, normalization and the XLA-compiled model run on the GPU.
+    """
+    height, width, _ = input_shape[1:]
+    
+    def load(path):
+        img = tf.io.decode_image(tf.io.read_file(path), channels=1, expand_animations=False)
+        img = tf.image.resize(img, (height, width), method='area')
+        return tf.image.grayscale_to_rgb(img)
+    
+    @tf.function(input_signature=[tf.TensorSpec([None], tf.string)])
+    def end_to_end(paths):
+        batch = tf.map_fn(load, paths, fn_output_signature=tf.TensorSpec(input_shape[1:], tf.float32))
+        return predict((batch - DENSENET_MEAN) / DENSENET_STD)
+    return end_to_end
+
 class ChestXRayDiagnosis:
-    def __init__(self, model_path='densenet.hdf5'):
-        """Initialize the diagnosis system"""
+    def __init__(self, model_path='densenet.hdf5', engine_path=TRT_ENGINE_PATH):
+        """Initialize the diagnosis system (TensorRT engine if built, else Keras)"""
+        self.labels = LABELS
+        self._end_to_end = None
+        
+        if os.path.exists(engine_path) and not os.path.exists(TRT_CALIB_CACHE_PATH):
+            print(f"⚠️  Ignoring {engine_path}: no INT8 calibration cache, rebuild it with build_trt_engine")
+        elif os.path.exists(engine_path):
+            try:
+                self._infer = TRTEngine(engine_path)
+                self.model = None
+                print(f"✅ TensorRT INT8 engine loaded from {engine_path}")
+                return
+            except Exception as e:
+                print(f"⚠️  Could not load TensorRT engine ({e}), falling back to Keras")
+        
+        from simple_diagnosis import SAVED_MODEL_PATH, saved_model_predict
+        if os.path.isdir(SAVED_MODEL_PATH):
+            try:
+                self.model = tf.saved_model.load(SAVED_MODEL_PATH)
+                self._infer = saved_model_predict(self.model)
+                print(f"✅ SavedModel loaded from {SAVED_MODEL_PATH}")
+                return
+            except Exception as e:
+                print(f"⚠️  Could not load SavedModel ({e}), falling back to HDF5")
+        
         print("Loading DenseNet-121 model...")
         try:
             self.model = load_model(model_path, compile=False)
@@ -33,132 +216,220 @@ class ChestXRayDiagnosis:
             print(f"❌ Error loading model: {e}")
             return
         
-        self.labels = LABELS
+        if tf.config.list_physical_devices('GPU'):
+            from simple_diagnosis import to_mixed_precision
+            self.model = to_mixed_precision(self.model)
+            print("✅ Running with mixed_float16 precision")
+        else:
+            # On CPU, prefer the INT8 ONNX Runtime session; any export, quantization
+            # or runtime error falls back to the XLA-compiled TF model below
+            try:
+                from simple_diagnosis import get_onnx_session
+                session = get_onnx_session(self.model, model_path)
+                input_name = session.get_inputs()[0].name
+                self._infer = lambda batch: session.run(None, {input_name: batch})[0]
+                print("✅ Using INT8 ONNX Runtime session for CPU inference")
+                return
+            except Exception as e:
+                print(f"⚠️  ONNX Runtime path unavailable ({e}), using TensorFlow")
         
-    def preprocess_image(self, image_path, target_size=(320, 320)):
-        """Preprocess X-ray image for model input"""
+        from simple_diagnosis import compile_predict
+        self._predict = compile_predict(self.model, (None,) + INPUT_SHAPE[1:])
+        self._infer = lambda batch: self._predict(tf.constant(batch)).numpy()
+        
+        if tf.config.list_physical_devices('GPU'):
+            self._end_to_end = build_end_to_end(self._predict)
+        
+    def preprocess_image(self, image_path, target_size=(320, 320), out=None):
+        """Preprocess X-ray image for model input
+
+        Returns (model_input, display_frame), the latter being the resized uint8 image.
+        Writes into out (a (1, H, W, 3) float32 array, e.g. a pinned host buffer) when given.
+        """
         try:
-            # Read image
-            img = cv2.imread(image_path)
-            if img is None:
+            # X-rays are single-channel, so read one plane instead of three
+            gray = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
+            if gray is None:
                 raise ValueError(f"Could not load image from {image_path}")
             
-            # Convert BGR to RGB
-            img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-            
-            # Resize to target size
-            img = cv2.resize(img, target_size)
+            # Resize while still uint8, so the float work touches the smaller frame
+            gray = cv2.resize(gray, target_size, interpolation=cv2.INTER_AREA)
             
-            # Convert to float32 and normalize
-            img = img.astype(np.float32)
+            # Broadcast to 3 channels, float cast and DenseNet ('torch' mode) normalization in one pass
+            if out is None:
+                out = np.empty((1,) + gray.shape + (3,), dtype=np.float32)
+            np.subtract(gray[..., None], DENSENET_MEAN, out=out[0], dtype=np.float32)
+            np.multiply(out[0], 1.0 / DENSENET_STD, out=out[0])
             
-            # Add batch dimension
-            img = np.expand_dims(img, axis=0)
-            
-            # Apply DenseNet preprocessing (expects values in [0, 255])
-            img = preprocess_input(img)
-            
-            return img
+            return out, gray
             
         except Exception as e:
             print(f"❌ Error preprocessing image: {e}")
             return None
     
     def predict_diseases(self, image_path, threshold=0.5):
-        """Predict diseases from chest X-ray"""
-        print(f"\n🔍 Analyzing X-ray: {os.path.basename(image_path)}")
-        
-        # Preprocess image
-        processed_img = self.preprocess_image(image_path)
-        if processed_img is None:
-            return None
+        """Predict diseases from chest X-ray
+
+        Returns (probabilities, detected_mask, display_frame); the first two are indexed like self.labels
+        """
+        batch = self.predict_diseases_batch([image_path], threshold)
+        return tuple(part[0] for part in batch) if batch else None
+    
+    def predict_diseases_batch(self, image_paths, threshold=0.5):
+        """Predict diseases for several chest X-rays with a single forward pass
+
+        Returns (probabilities, detected_mask, display_frames): two (N, len(self.labels))
+        arrays and the N resized uint8 frames (None where preprocessing ran on the GPU)
+        """
+        for image_path in image_paths:
+            print(f"\n🔍 Analyzing X-ray: {os.path.basename(image_path)}")
         
         # Make prediction
         try:
-            predictions = self.model.predict(processed_img, verbose=0)
-            
-            # Handle different output shapes
-            if len(predictions.shape) > 1:
-                predictions = predictions[0]  # Remove batch dimension
-            
-            # Ensure we have the right number of predictions
-            if len(predictions) != len(self.labels):
-                print(f"⚠️  Model output shape mismatch: got {len(predictions)}, expected {len(self.labels)}")
-                # Take first 14 predictions if more, pad with zeros if less
-                if len(predictions) > len(self.labels):
-                    predictions = predictions[:len(self.labels)]
-                else:
-                    predictions = np.pad(predictions, (0, len(self.labels) - len(predictions)))
-            
-            # Create results
-            results = []
-            for i, (label, prob) in enumerate(zip(self.labels, predictions)):
-                results.append({
-                    'disease': label,
-                    'probability': float(prob),
-                    'detected': prob > threshold
-                })
+            if self._end_to_end is not None:
+                # On GPU, preprocessing runs inside the same graph as the model
+                predictions = self._end_to_end(tf.constant(image_paths)).numpy()
+                frames = [None] * len(image_paths)
+            elif isinstance(self._infer, TRTEngine) and len(image_paths) == len(self._infer.host_input):
+                # Preprocess straight into the engine's pinned buffer, skipping the staging copy
+                host_input = self._infer.host_input
+                frames = []
+                for i, image_path in enumerate(image_paths):
+                    preprocessed = self.preprocess_image(image_path, out=host_input[i:i + 1])
+                    if preprocessed is None:
+                        return None
+                    frames.append(preprocessed[1])
+                predictions = self._infer.run()
+            else:
+                processed, frames = [], []
+                for image_path in image_paths:
+                    # Preprocess image
+                    preprocessed = self.preprocess_image(image_path)
+                    if preprocessed is None:
+                        return None
+                    processed.append(preprocessed[0])
+                    frames.append(preprocessed[1])
+                predictions = self._infer(np.concatenate(processed, axis=0))
             
-            return results
+            return self._postprocess(predictions, len(image_paths), threshold) + (frames,)
             
         except Exception as e:
             print(f"❌ Error during prediction: {e}")
             return None
     
+    def iter_predictions(self, image_paths, threshold=0.5):
+        """Yield (image_path, results) per image, preprocessing the next image while the current one infers
+
+        OpenCV and the model both release the GIL, so the two stages genuinely overlap.
+        """
+        if not image_paths:
+            return
+        
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            pending = pool.submit(self.preprocess_image, image_paths[0])
+            for i, image_path in enumerate(image_paths):
+                print(f"\n🔍 Analyzing X-ray: {os.path.basename(image_path)}")
+                preprocessed = pending.result()
+                if i + 1 < len(image_paths):
+                    pending = pool.submit(self.preprocess_image, image_paths[i + 1])
+                
+                if preprocessed is None:
+                    yield image_path, None
+                    continue
+                processed_img, frame = preprocessed
+                try:
+                    predictions, detected = self._postprocess(self._infer(processed_img), 1, threshold)
+                    yield image_path, (predictions[0], detected[0], frame)
+                except Exception as e:
+                    print(f"❌ Error during prediction: {e}")
+                    yield image_path, None
+    
+    def _postprocess(self, predictions, n_images, threshold):
+        """Shape raw model output into (probabilities, detected_mask) of shape (N, len(self.labels))"""
+        predictions = np.asarray(predictions, dtype=np.float32).reshape(n_images, -1)
+        
+        # Ensure we have the right number of predictions
+        n_labels = len(self.labels)
+        if predictions.shape[1] != n_labels:
+            print(f"⚠️  Model output shape mismatch: got {predictions.shape[1]}, expected {n_labels}")
+            # Take first 14 predictions if more, pad with zeros if less
+            if predictions.shape[1] > n_labels:
+                predictions = predictions[:, :n_labels]
+            else:
+                predictions = np.pad(predictions, ((0, 0), (0, n_labels - predictions.shape[1])))
+        
+        return predictions, predictions > threshold
+    
     def display_results(self, results, image_path):
-        """Display diagnosis results"""
+        """Display diagnosis results for one (probabilities, detected_mask, display_frame) triple"""
         if results is None:
             return
+        predictions, detected_mask, img = results
         
         print("\n" + "="*60)
         print("🏥 CHEST X-RAY DIAGNOSIS RESULTS")
         print("="*60)
         
-        # Sort by probability (highest first)
-        results_sorted = sorted(results, key=lambda x: x['probability'], reverse=True)
-        
-        # Show detected diseases
-        detected = [r for r in results_sorted if r['detected']]
+        # Show detected diseases (highest probability first)
+        detected_idx = np.flatnonzero(detected_mask)
+        detected_idx = detected_idx[np.argsort(-predictions[detected_idx])]
+        detected = [self.labels[i] for i in detected_idx]
         if detected:
             print("\n🚨 DETECTED CONDITIONS:")
-            for result in detected:
-                print(f"   • {result['disease']}: {result['probability']:.1%} confidence")
+            for i in detected_idx:
+                print(f"   • {self.labels[i]}: {predictions[i]:.1%} confidence")
         else:
             print("\n✅ NO SIGNIFICANT ABNORMALITIES DETECTED")
         
         # Show top 5 probabilities
+        top_idx = rank_predictions(predictions[None])[0]
         print(f"\n📊 TOP 5 PROBABILITIES:")
-        for i, result in enumerate(results_sorted[:5]):
-            status = "🔴" if result['detected'] else "🟢"
-            print(f"   {i+1}. {status} {result['disease']}: {result['probability']:.1%}")
+        for rank, i in enumerate(top_idx):
+            status = "🔴" if detected_mask[i] else "🟢"
+            print(f"   {rank+1}. {status} {self.labels[i]}: {predictions[i]:.1%}")
         
-        # Display image
+        # Reuse the frame decoded for inference; only the GPU graph path leaves none behind
         try:
-            img = cv2.imread(image_path)
-            img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-            
-            plt.figure(figsize=(10, 8))
-            plt.imshow(img, cmap='gray')
-            plt.title(f"Chest X-Ray Analysis: {os.path.basename(image_path)}")
-            plt.axis('off')
-            
-            # Add results text
-            detected_text = ", ".join([r['disease'] for r in detected]) if detected else "No abnormalities"
-            plt.figtext(0.5, 0.02, f"Detected: {detected_text}", ha='center', fontsize=10)
+            if img is None:
+                img = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
+            detected_text = ", ".join(detected) if detected else "No abnormalities"
             
-            plt.tight_layout()
-            plt.show()
+            if os.environ.get('SHOW_PLOTS'):
+                # Interactive window only on request; matplotlib is otherwise never imported
+                import matplotlib.pyplot as plt
+                
+                plt.figure(figsize=(10, 8))
+                plt.imshow(img, cmap='gray')
+                plt.title(f"Chest X-Ray Analysis: {os.path.basename(image_path)}")
+                plt.axis('off')
+                
+                # Add results text
+                plt.figtext(0.5, 0.02, f"Detected: {detected_text}", ha='center', fontsize=10)
+                
+                plt.tight_layout()
+                plt.show()
+            else:
+                # Annotate the uint8 frame directly and save it as a JPEG
+                annotated = cv2.cvtColor(img, cv2.COLOR_GRAY2BGR)
+                cv2.putText(annotated, f"Detected: {detected_text}", (10, annotated.shape[0] - 10),
+                            cv2.FONT_HERSHEY_SIMPLEX, 0.4, (0, 255, 0), 1, cv2.LINE_AA)
+                output_path = f"{os.path.splitext(os.path.basename(image_path))[0]}_result.jpg"
+                cv2.imwrite(output_path, annotated, [cv2.IMWRITE_JPEG_QUALITY, 85])
+                print(f"\n🖼️  Annotated image saved to {output_path}")
             
         except Exception as e:
             print(f"⚠️  Could not display image: {e}")
 
+# With PRELOAD_MODEL=1 (e.g. a server importing this module) the model is loaded and warmed at import
+DIAGNOSIS = ChestXRayDiagnosis() if os.environ.get('PRELOAD_MODEL') else None
+
 def main():
     """Main function to run the diagnosis system"""
     print("🏥 Chest X-Ray Medical Diagnosis System")
     print("=" * 50)
     
     # Initialize diagnosis system
-    diagnosis = ChestXRayDiagnosis()
+    diagnosis = DIAGNOSIS or ChestXRayDiagnosis()
     
     # Check if model loaded successfully
     if not hasattr(diagnosis, 'model'):
@@ -167,7 +438,11 @@ def main():
     # Use sample image from assets
     sample_image = "asset/00025288_001.png"
     
-    if os.path.exists(sample_image):
+    if len(sys.argv) > 1:
+        # Several images on the command line: pipeline preprocessing with inference
+        for image_path, results in diagnosis.iter_predictions(sys.argv[1:]):
+            diagnosis.display_results(results, image_path)
+    elif os.path.exists(sample_image):
         print(f"\n📸 Using sample X-ray: {sample_image}")
         results = diagnosis.predict_diseases(sample_image)
         diagnosis.display_results(results, sample_image)
@@ -12,6 +12,7 @@ import http.server
 import socketserver
 from threading import Thread
 import signal
+from cleanup_ports import free_ports
 
 def start_backend():
     """Start Flask backend"""
@@ -53,29 +54,8 @@ def start_html_server():
 
 def kill_existing_processes():
     """Kill any existing processes on our ports"""
-    import subprocess
-    
-    ports = [5001, 8080, 3000, 5002, 5003]
     print("🧹 Cleaning up existing processes...")
-    
-    for port in ports:
-        try:
-            # Kill processes on port
-            subprocess.run(["lsof", "-ti", f":{port}"], 
-                         stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
-            subprocess.run(["lsof", "-ti", f":{port}"], 
-                         stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            result = subprocess.run(["lsof", "-ti", f":{port}"], 
-                                  capture_output=True, text=True)
-            if result.stdout.strip():
-                pids = result.stdout.strip().split('\n')
-                for pid in pids:
-                    if pid:
-                        subprocess.run(["kill", "-9", pid], 
-                                     stderr=subprocess.DEVNULL)
-        except:
-            pass  # Port not in use or kill failed
-    
+    free_ports({5001, 8080, 3000, 5002, 5003})
     print("✅ Ports cleaned up")
 
 def main():
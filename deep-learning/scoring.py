@@ -0,0 +1,19 @@
+#!/usr/bin/env python3
+"""
+Vectorized scoring helpers shared by the API and the test scripts
+"""
+
+import numpy as np
+
+DETECTION_THRESHOLD = 0.5
+SEVERITY_LEVELS = ('High', 'Medium', 'Low')
+_SEVERITY_NAMES = np.array(SEVERITY_LEVELS)
+
+def filter_detected(probs, threshold=DETECTION_THRESHOLD):
+    """Boolean mask of the labels whose probability is above the threshold"""
+    return np.asarray(probs) > threshold
+
+def severity_bucket(probs):
+    """Severity level per probability: High above 0.7, Medium above 0.4, otherwise Low"""
+    probs = np.asarray(probs)
+    return _SEVERITY_NAMES[np.where(probs > 0.7, 0, np.where(probs > 0.4, 1, 2))]
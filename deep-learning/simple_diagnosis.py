@@ -6,9 +6,9 @@ Simple Chest X-Ray Diagnosis Demo
 import os
 import numpy as np
 import cv2
-import matplotlib.pyplot as plt
 import tensorflow as tf
 from tensorflow.keras.models import load_model
+from tensorflow.keras import mixed_precision
 import warnings
 warnings.filterwarnings('ignore')
 
@@ -19,11 +19,101 @@ LABELS = [
     'Nodule', 'Pleural_Thickening', 'Pneumonia', 'Pneumothorax'
 ]
 
+# CPU inference path: dynamic-shape ONNX export, quantized to INT8 weights,
+# written next to the source model with these suffixes
+ONNX_SUFFIX = '.cpu.onnx'
+ONNX_INT8_SUFFIX = '.cpu.int8.onnx'
+_onnx_sessions = {}
+
+# SavedModel export: loads the serialized graph without rebuilding ~430 Keras layers in Python
+SAVED_MODEL_PATH = 'densenet_sm'
+
+def get_onnx_session(model, model_path):
+    """ONNX Runtime session over the INT8-quantized model
+
+    The ONNX files sit next to model_path (the file model was loaded from) and
+    are re-exported whenever that file is newer than them. Raises ImportError
+    when onnxruntime/tf2onnx aren't installed.
+    """
+    if model_path not in _onnx_sessions:
+        import onnxruntime as ort
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+        
+        stem = os.path.splitext(model_path)[0]
+        onnx_path, int8_path = stem + ONNX_SUFFIX, stem + ONNX_INT8_SUFFIX
+        if not os.path.exists(int8_path) or os.path.getmtime(int8_path) < os.path.getmtime(model_path):
+            import tf2onnx
+            spec = (tf.TensorSpec((None,) + tuple(model.input_shape[1:]), tf.float32, name='input'),)
+            tf2onnx.convert.from_keras(model, input_signature=spec, opset=13, output_path=onnx_path)
+            quantize_dynamic(model_input=onnx_path, model_output=int8_path,
+                             weight_type=QuantType.QInt8)
+        
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        _onnx_sessions[model_path] = ort.InferenceSession(int8_path, sess_options=options,
+                                                          providers=['CPUExecutionProvider'])
+    return _onnx_sessions[model_path]
+
+def to_mixed_precision(model):
+    """Rebuild a functional Keras model with mixed_float16 layers on tensor-core GPUs
+
+    load_model restores each layer's saved float32 dtype, so setting the global
+    policy alone has no effect on an HDF5 model; the config is rewritten instead.
+    The output layer stays float32 so the sigmoid probabilities keep full precision.
+    """
+    if not tf.config.list_physical_devices('GPU'):
+        return model
+    
+    tf.config.experimental.enable_tensor_float_32_execution(True)
+    mixed_precision.set_global_policy('mixed_float16')
+    
+    config = model.get_config()
+    for layer in config['layers'][1:-1]:
+        if layer['class_name'] != 'InputLayer':
+            layer['config']['dtype'] = 'mixed_float16'
+    mixed_model = tf.keras.Model.from_config(config)
+    mixed_model.set_weights(model.get_weights())
+    return mixed_model
+
+def compile_predict(model, input_shape):
+    """XLA-compiled forward pass for a fixed input shape, traced once and warmed up"""
+    predict = tf.function(lambda x: model(x, training=False), jit_compile=True,
+                          input_signature=[tf.TensorSpec(input_shape, tf.float32)])
+    predict(tf.zeros([1 if d is None else d for d in input_shape], tf.float32))
+    return predict
+
+def convert_to_saved_model(hdf5_path='densenet.hdf5', export_path=SAVED_MODEL_PATH):
+    """One-time export of the HDF5 model to a SavedModel directory
+
+    python3 -c "import simple_diagnosis as s; s.convert_to_saved_model()"
+    """
+    model = load_model(hdf5_path, compile=False)
+    tf.saved_model.save(model, export_path)
+    return export_path
+
+def saved_model_predict(saved_model):
+    """Callable running a loaded SavedModel's serving signature on a float32 batch"""
+    signature = saved_model.signatures['serving_default']
+    input_name = next(iter(signature.structured_input_signature[1]))
+    
+    def predict(batch):
+        outputs = signature(**{input_name: tf.constant(batch, tf.float32)})
+        return next(iter(outputs.values())).numpy()
+    return predict
+
 def load_and_inspect_model():
     """Load model and inspect its architecture"""
     try:
         print("🔍 Loading and inspecting model...")
-        model = load_model('densenet.hdf5', compile=False)
+        if os.path.isdir(SAVED_MODEL_PATH):
+            model = tf.saved_model.load(SAVED_MODEL_PATH)
+            signature = model.signatures['serving_default']
+            print(f"✅ SavedModel loaded from {SAVED_MODEL_PATH}")
+            print(f"📊 Inputs: {signature.structured_input_signature[1]}")
+            print(f"📊 Outputs: {signature.structured_outputs}")
+            return model
+        
+        model = to_mixed_precision(load_model('densenet.hdf5', compile=False))
         
         print(f"✅ Model loaded successfully!")
         print(f"📊 Input shape: {model.input_shape}")
@@ -44,23 +134,18 @@ def preprocess_image_simple(image_path, target_size=(224, 224)):
     """Simple image preprocessing"""
     try:
         # Read and preprocess image
-        img = cv2.imread(image_path)
+        img = cv2.imread(image_path, cv2.IMREAD_COLOR)
         if img is None:
             raise ValueError(f"Could not load image: {image_path}")
         
-        # Convert BGR to RGB
-        img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+        # Resize while still uint8
+        img = cv2.resize(img, target_size, interpolation=cv2.INTER_AREA)
         
-        # Resize
-        img = cv2.resize(img, target_size)
+        # BGR->RGB, float cast and [0,1] scaling into the batch buffer in one pass
+        out = np.empty((1,) + img.shape, dtype=np.float32)
+        np.multiply(img[..., ::-1], 1.0 / 255.0, out=out[0], dtype=np.float32)
         
-        # Normalize to [0,1]
-        img = img.astype(np.float32) / 255.0
-        
-        # Add batch dimension
-        img = np.expand_dims(img, axis=0)
-        
-        return img
+        return out
         
     except Exception as e:
         print(f"❌ Error preprocessing: {e}")
@@ -93,7 +178,17 @@ def demo_prediction():
     try:
         # Make prediction
         print("🔮 Making prediction...")
-        predictions = model.predict(processed_img, verbose=0)
+        if not isinstance(model, tf.keras.Model):
+            # SavedModel: call its serving signature
+            predictions = saved_model_predict(model)(processed_img)
+        else:
+            try:
+                session = get_onnx_session(model, 'densenet.hdf5')
+                predictions = session.run(None, {session.get_inputs()[0].name: processed_img})[0]
+            except Exception:
+                # onnxruntime/tf2onnx not installed, or the export failed
+                predict = compile_predict(model, processed_img.shape)
+                predictions = predict(tf.constant(processed_img)).numpy()
         
         print(f"📊 Raw prediction shape: {predictions.shape}")
         print(f"📊 Raw predictions: {predictions}")
@@ -125,18 +220,20 @@ def demo_prediction():
                 print(f"  Output {i}: {pred:.6f}")
         
         # Display the image
-        display_image(sample_image)
+        display_image(sample_image, processed_img[0])
         
     except Exception as e:
         print(f"❌ Error during prediction: {e}")
         import traceback
         traceback.print_exc()
 
-def display_image(image_path):
-    """Display the X-ray image"""
+def display_image(image_path, img):
+    """Display the already-preprocessed X-ray image (only when SHOW_PLOTS is set)"""
+    if not os.environ.get('SHOW_PLOTS'):
+        return
+    
     try:
-        img = cv2.imread(image_path)
-        img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+        import matplotlib.pyplot as plt
         
         plt.figure(figsize=(8, 6))
         plt.imshow(img, cmap='gray')
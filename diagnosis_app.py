@@ -1,29 +1,128 @@
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, Response, render_template, request, jsonify
 import tensorflow as tf
 import numpy as np
-from PIL import Image
-import io
+import cv2
 import base64
 import os
+import threading
+import queue
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+import orjson
 
 app = Flask(__name__)
 
+def ojsonify(obj):
+    """jsonify via orjson, which also serializes numpy scalars/arrays directly"""
+    return app.response_class(orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY),
+                              mimetype='application/json')
+
+# Echoed images are base64-encoded and streamed in chunks of this many bytes
+# (a multiple of 3, so each chunk encodes without padding)
+ECHO_CHUNK_SIZE = 3 * 64 * 1024
+
+# Image decode/resize runs here (OpenCV releases the GIL), off the Flask request threads
+DECODE_EXECUTOR = ThreadPoolExecutor(max_workers=int(os.environ.get('DECODE_WORKERS', 4)))
+
+# Request batching: concurrent /diagnose calls share one forward pass
+BATCH_SIZE = int(os.environ.get('BATCH_SIZE', 16))
+BATCH_WAIT_MS = float(os.environ.get('BATCH_WAIT_MS', 20))
+
+INPUT_SHAPE = (None, 224, 224, 1)
+TFLITE_MODEL_PATH = 'chest_xray_int8.tflite'  # written by quantize.py
+TFLITE_FP32_MODEL_PATH = 'chest_xray_fp32.tflite'  # USE_TFLITE=1: float model on XNNPACK kernels
+
 class ChestXrayDiagnosis:
     def __init__(self):
         self.model = None
+        # File self.model was loaded from; None for the untrained fallback CNN
+        self.model_path = None
+        self.interpreter = None
+        self.input_dtype = np.float32
+        # Per-thread preprocessing buffers, reused across requests on the same worker thread
+        self._buffers = threading.local()
         self.class_names = [
             'Atelectasis', 'Cardiomegaly', 'Effusion', 'Infiltration',
             'Mass', 'Nodule', 'Pneumonia', 'Pneumothorax',
             'Consolidation', 'Edema', 'Emphysema', 'Fibrosis',
             'Pleural_Thickening', 'Hernia', 'No Finding'
         ]
+        
+        if os.path.exists(TFLITE_MODEL_PATH):
+            # INT8 TFLite model for CPU inference
+            self._infer_batch = self.load_tflite(TFLITE_MODEL_PATH)
+            return
+        
         self.load_model()
+        
+        if os.environ.get('USE_TFLITE') and self.model_path:
+            # TFLite applies the XNNPACK delegate to float models by default.
+            # Only a model loaded from disk is converted, and the conversion is
+            # redone whenever that file is newer than the cached one
+            if (not os.path.exists(TFLITE_FP32_MODEL_PATH)
+                    or os.path.getmtime(TFLITE_FP32_MODEL_PATH) < os.path.getmtime(self.model_path)):
+                with open(TFLITE_FP32_MODEL_PATH, 'wb') as f:
+                    f.write(tf.lite.TFLiteConverter.from_keras_model(self.model).convert())
+            self._infer_batch = self.load_tflite(TFLITE_FP32_MODEL_PATH)
+            return
+        
+        if os.environ.get('USE_FP16'):
+            # Half-precision compute and inputs on hardware with fast FP16 (tensor cores, AVX-512-FP16)
+            self.model = self.to_mixed_precision(self.model)
+            self.input_dtype = np.float16
+        
+        # Trace the forward pass once at startup; every call reuses the concrete function
+        self._infer = tf.function(lambda x: self.model(x, training=False),
+                                  input_signature=[tf.TensorSpec(INPUT_SHAPE, tf.as_dtype(self.input_dtype))])
+        self._infer.get_concrete_function()
+        self._infer_batch = lambda batch: self._infer(tf.constant(batch)).numpy()
+    
+    def to_mixed_precision(self, model):
+        """Rebuild the model with mixed_float16 layers, keeping the sigmoid output in float32
+
+        Saved models restore each layer's float32 dtype, so the global policy alone isn't enough.
+        """
+        tf.keras.mixed_precision.set_global_policy('mixed_float16')
+        config = model.get_config()
+        for layer in config['layers'][:-1]:
+            if layer['class_name'] != 'InputLayer':
+                layer['config']['dtype'] = 'mixed_float16'
+        mixed_model = model.__class__.from_config(config)
+        mixed_model.set_weights(model.get_weights())
+        return mixed_model
+    
+    def load_tflite(self, model_path):
+        """Wrap a TFLite model (float or full-integer) so it takes and returns float32 like the Keras path"""
+        self.interpreter = tf.lite.Interpreter(model_path=model_path, num_threads=os.cpu_count())
+        self.interpreter.allocate_tensors()
+        input_details = self.interpreter.get_input_details()[0]
+        output_details = self.interpreter.get_output_details()[0]
+        input_scale, input_zero = input_details['quantization']
+        output_scale, output_zero = output_details['quantization']
+        input_shape = [tuple(input_details['shape'])]
+        
+        def infer(batch):
+            if batch.shape != input_shape[0]:
+                self.interpreter.resize_tensor_input(input_details['index'], batch.shape)
+                self.interpreter.allocate_tensors()
+                input_shape[0] = batch.shape
+            if input_details['dtype'] == np.int8:
+                batch = np.clip(np.round(batch / input_scale + input_zero), -128, 127).astype(np.int8)
+            self.interpreter.set_tensor(input_details['index'], batch)
+            self.interpreter.invoke()
+            output = self.interpreter.get_tensor(output_details['index'])
+            if output_details['dtype'] == np.int8:
+                output = (output.astype(np.float32) - output_zero) * output_scale
+            return output
+        return infer
     
     def load_model(self):
         """Load pre-trained model or create a simple CNN"""
         try:
-            # Try to load existing model
-            self.model = tf.keras.models.load_model('chest_xray_model.h5')
+            # Try to load existing model, preferring the .keras export (see deep-learning/convert_model.py)
+            model_path = 'chest_xray_model.keras' if os.path.exists('chest_xray_model.keras') else 'chest_xray_model.h5'
+            self.model = tf.keras.models.load_model(model_path)
+            self.model_path = model_path
         except:
             # Create a simple CNN model for demonstration
             self.model = self.create_simple_model()
@@ -50,45 +149,96 @@ class ChestXrayDiagnosis:
         )
         return model
     
-    def preprocess_image(self, image):
-        """Preprocess uploaded image"""
-        # Convert to grayscale
-        if image.mode != 'L':
-            image = image.convert('L')
-        
-        # Resize to model input size
-        image = image.resize((224, 224))
-        
-        # Convert to numpy array and normalize
-        img_array = np.array(image) / 255.0
-        img_array = np.expand_dims(img_array, axis=-1)  # Add channel dimension
-        img_array = np.expand_dims(img_array, axis=0)   # Add batch dimension
-        
-        return img_array
+    def preprocess_image(self, image_bytes):
+        """Preprocess uploaded image bytes into a (1, 224, 224, 1) batch"""
+        return self.to_batch(self.decode_and_resize(image_bytes))
     
-    def predict(self, image):
-        """Make prediction on chest X-ray image"""
-        processed_image = self.preprocess_image(image)
-        
-        # Make prediction
-        predictions = self.model.predict(processed_image)[0]
+    def decode_and_resize(self, image_bytes):
+        """Decode straight to grayscale and resize to the model input size (uint8)
+
+        Safe to run on any thread: it only touches the arrays it allocates.
+        """
+        img = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), cv2.IMREAD_GRAYSCALE)
+        if img is None:
+            raise ValueError("Could not decode image")
+        return cv2.resize(img, (224, 224), interpolation=cv2.INTER_AREA)
+    
+    def to_batch(self, resized):
+        """Cast and scale a resized frame to [0, 1] in this thread's reusable batch buffer"""
+        buffers = self._buffers
+        if not hasattr(buffers, 'batch'):
+            buffers.batch = np.empty((1, 224, 224, 1), dtype=self.input_dtype)
         
-        # Create results with confidence scores
-        results = []
-        for i, class_name in enumerate(self.class_names):
-            confidence = float(predictions[i])
-            results.append({
-                'condition': class_name,
-                'confidence': round(confidence * 100, 2),
-                'probability': round(confidence, 4)
-            })
+        # The buffer is only reused once this thread's request has finished with it
+        np.multiply(resized, 1.0 / 255.0, out=buffers.batch[0, :, :, 0])
+        return buffers.batch
+    
+    def predict_batch(self, batch):
+        """Run an (N, 224, 224, 1) batch through the model"""
+        return self._infer_batch(batch)
+    
+    def predict(self, image_bytes):
+        """Make prediction on chest X-ray image bytes"""
+        processed_image = self.preprocess_image(image_bytes)
+        return self.format_results(self.predict_batch(processed_image)[0])
+    
+    def format_results(self, predictions):
+        """Turn one image's class probabilities into the sorted results list"""
+        # Round and order all classes at once, highest confidence first
+        predictions = np.asarray(predictions, dtype=np.float64)
+        confidence = np.round(predictions * 100, 2).tolist()
+        probability = np.round(predictions, 4).tolist()
+        order = np.argsort(-predictions, kind='stable').tolist()
         
-        # Sort by confidence
-        results.sort(key=lambda x: x['confidence'], reverse=True)
-        return results
+        return [{
+            'condition': self.class_names[i],
+            'confidence': confidence[i],
+            'probability': probability[i]
+        } for i in order]
+
+class BatchPredictor:
+    """Coalesce concurrent single-image requests into one model call"""
+    
+    def __init__(self, predict_fn, max_batch_size=BATCH_SIZE, max_wait_ms=BATCH_WAIT_MS):
+        self.predict_fn = predict_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.requests = queue.Queue()
+        self.worker = threading.Thread(target=self._run, daemon=True)
+        self.worker.start()
+    
+    def submit(self, img):
+        """Queue a (1, H, W, C) preprocessed image and return a Future for its prediction row"""
+        future = Future()
+        self.requests.put((img, future))
+        return future
+    
+    def _run(self):
+        while True:
+            batch = [self.requests.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.requests.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            
+            images, futures = zip(*batch)
+            try:
+                outputs = self.predict_fn(np.concatenate(images, axis=0))
+            except Exception as e:
+                for future in futures:
+                    future.set_exception(e)
+                continue
+            for i, future in enumerate(futures):
+                future.set_result(outputs[i])
 
 # Initialize diagnosis system
 diagnosis_system = ChestXrayDiagnosis()
+batch_predictor = BatchPredictor(diagnosis_system.predict_batch)
 
 @app.route('/')
 def index():
@@ -105,23 +255,30 @@ def diagnose():
     
     try:
         # Read and process image
-        image = Image.open(file.stream)
+        image_bytes = file.read()
+        
+        # Decode on the pool, then make prediction (batched with any concurrent requests)
+        resized = DECODE_EXECUTOR.submit(diagnosis_system.decode_and_resize, image_bytes).result()
+        processed_image = diagnosis_system.to_batch(resized)
+        predictions = batch_predictor.submit(processed_image).result()
+        results = diagnosis_system.format_results(predictions)
         
-        # Make prediction
-        results = diagnosis_system.predict(image)
+        # The client already has the image; echo the uploaded bytes only when asked to
+        if request.args.get('echo') != '1':
+            return ojsonify({
+                'success': True,
+                'predictions': results
+            })
         
-        # Convert image to base64 for display
-        img_buffer = io.BytesIO()
-        if image.mode != 'RGB':
-            image = image.convert('RGB')
-        image.save(img_buffer, format='JPEG')
-        img_str = base64.b64encode(img_buffer.getvalue()).decode()
+        def stream_with_image():
+            # Base64 the echo chunk by chunk instead of building the whole JSON string first
+            yield b'{"success":true,"predictions":' + orjson.dumps(results) + b',"image":"'
+            view = memoryview(image_bytes)
+            for start in range(0, len(view), ECHO_CHUNK_SIZE):
+                yield base64.b64encode(view[start:start + ECHO_CHUNK_SIZE])
+            yield b'"}'
         
-        return jsonify({
-            'success': True,
-            'predictions': results,
-            'image': img_str
-        })
+        return Response(stream_with_image(), mimetype='application/json')
         
     except Exception as e:
         return jsonify({'error': f'Error processing image: {str(e)}'})
@@ -129,10 +286,10 @@ def diagnose():
 @app.route('/model_info')
 def model_info():
     return jsonify({
-        'model_loaded': diagnosis_system.model is not None,
+        'model_loaded': diagnosis_system.model is not None or diagnosis_system.interpreter is not None,
         'classes': diagnosis_system.class_names,
         'total_classes': len(diagnosis_system.class_names)
     })
 
 if __name__ == '__main__':
-    app.run(debug=True, host='0.0.0.0', port=5002)
\ No newline at end of file
+    app.run(debug=os.environ.get('FLASK_ENV') == 'development', host='0.0.0.0', port=5002)
\ No newline at end of file
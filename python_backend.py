@@ -1,21 +1,33 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request
 from flask_cors import CORS
 import pandas as pd
 import numpy as np
-from PIL import Image
+from PIL import Image, UnidentifiedImageError
 import cv2
 from mlxtend.frequent_patterns import apriori, association_rules
 from mlxtend.preprocessing import TransactionEncoder
 import io
-import base64
 import os
 from dotenv import load_dotenv
 import google.generativeai as genai
 import pickle
 import json
+import orjson
+import copy
+import hashlib
+import threading
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from bisect import bisect_right
 from datetime import datetime
 import logging
 
+# scikit-image is optional; without it texture_uniformity falls back to a default
+try:
+    from skimage.feature import local_binary_pattern
+except ImportError:
+    local_binary_pattern = None
+
 # Load environment variables
 load_dotenv()
 
@@ -29,25 +41,121 @@ genai.configure(api_key=os.getenv('GEMINI_API_KEY'))
 app = Flask(__name__)
 CORS(app, origins=['http://localhost:3000'])
 
+def ojsonify(obj):
+    """jsonify via orjson, which also serializes numpy scalars/arrays directly"""
+    return app.response_class(orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY),
+                              mimetype='application/json')
+
+# Runs the Gemini round-trip while the request thread does the traditional analysis
+gemini_executor = ThreadPoolExecutor(max_workers=4)
+
+# Ask Gemini for a bare JSON reply (models that support it)
+GEMINI_JSON_CONFIG = {'response_mime_type': 'application/json'}
+
+# Decodes the first JSON object in a Gemini reply, ignoring any prose around it
+JSON_DECODER = json.JSONDecoder()
+
+# Uploads are rejected (413) above MAX_UPLOAD_BYTES, and images above
+# MAX_IMAGE_PIXELS (400) before any pixel data is decoded
+MAX_UPLOAD_BYTES = 10 * 1024 * 1024
+MAX_IMAGE_PIXELS = 25_000_000
+app.config['MAX_CONTENT_LENGTH'] = MAX_UPLOAD_BYTES
+Image.MAX_IMAGE_PIXELS = MAX_IMAGE_PIXELS
+
+# Completed analyses kept per upload digest, so resubmitting an image skips Gemini and OpenCV
+ANALYSIS_CACHE_SIZE = int(os.getenv('ANALYSIS_CACHE_SIZE', 64))
+
+# Trained model written by train_apriori_model.py (.pkl plus parquet exports)
+MODEL_STEM = 'chest_xray_apriori_model'
+# The exports are only used when all of them are present
+MODEL_EXPORTS = [MODEL_STEM + suffix for suffix in
+                 ('_itemsets.parquet', '_rules.parquet', '_feature_rules.pkl')]
+
+# Side of the square greyscale image the traditional features are computed on
+FEATURE_SIZE = 512
+
+# Uploaded JPEGs up to this many pixels are analyzed without re-encoding
+PASSTHROUGH_PIXELS = 1024 * 1024
+
+# DCT-domain downscaled decodes, largest reduction first
+REDUCED_COLOR_FLAGS = (
+    (8, cv2.IMREAD_REDUCED_COLOR_8),
+    (4, cv2.IMREAD_REDUCED_COLOR_4),
+    (2, cv2.IMREAD_REDUCED_COLOR_2),
+)
+
+# Grey levels of a uint8 image, for moments computed from its histogram
+INTENSITY_LEVELS = np.arange(256, dtype=np.float64)
+
+def _above(x):
+    """Smallest float greater than x, so bisect_right keeps x itself in the lower band"""
+    return float(np.nextafter(x, np.inf))
+
+# Rule-based conditions per feature band: (feature, default if missing or None
+# when required, ascending band edges, conditions for each of the len(edges)+1
+# bands). Band i holds values in [edges[i-1], edges[i]); _above() turns an
+# edge into a strict "greater than".
+CONDITION_BANDS = (
+    ('brightness', None, (90, 110, _above(150)), (
+        ('Pneumonia', 'Pleural_Effusion', 'Consolidation'),
+        ('Infiltration', 'Atelectasis'),
+        (),
+        ('Emphysema', 'Pneumothorax'),
+    )),
+    ('contrast', None, (30, _above(50), _above(70)), (
+        ('Pneumothorax', 'Emphysema'),
+        (),
+        ('Cardiomegaly', 'Edema'),
+        ('Mass', 'Nodule', 'Fibrosis'),
+    )),
+    ('edge_density', None, (_above(0.10), _above(0.15)), (
+        (),
+        ('Atelectasis', 'Consolidation'),
+        ('Fibrosis', 'Pleural_Thickening'),
+    )),
+    ('symmetry', 0.5, (0.7,), (
+        ('Cardiomegaly', 'Mass', 'Pleural_Effusion'),
+        (),
+    )),
+)
+
+# Rule consequents reported as potential complications rather than associations
+SEVERE_CONDITIONS = frozenset([
+    'Respiratory_Failure', 'Heart_Failure', 'Sepsis', 'ARDS',
+    'Cardiac_Arrest', 'Lung_Cancer', 'Pulmonary_Embolism'
+])
+
+def lists_to_frozensets(df):
+    """Restore the frozenset itemset columns of a DataFrame read from parquet"""
+    for col in ('itemsets', 'antecedents', 'consequents'):
+        if col in df:
+            df[col] = [frozenset(items) for items in df[col]]
+    return df
+
 class EnhancedChestXrayAnalyzer:
     def __init__(self):
         self.frequent_itemsets = None
         self.rules = None
         self.feature_rules = None
+        self._ante_index = {}
+        self._consequents_list = []
+        self._confidence_arr = np.empty(0)
         self.gemini_model = None
+        self._analysis_cache = OrderedDict()
+        self._analysis_cache_lock = threading.Lock()
         self.initialize_gemini()
         self.load_trained_model()
     
     def initialize_gemini(self):
         """Initialize Gemini AI model"""
         try:
-            self.gemini_model = genai.GenerativeModel('gemini-2.0-flash-exp')
+            self.gemini_model = genai.GenerativeModel('gemini-2.0-flash-exp', generation_config=GEMINI_JSON_CONFIG)
             logger.info("Gemini 2.0 Flash model initialized successfully")
         except Exception as e:
             logger.error(f"Failed to initialize Gemini model: {e}")
             # Fallback to other models
             try:
-                self.gemini_model = genai.GenerativeModel('gemini-1.5-flash')
+                self.gemini_model = genai.GenerativeModel('gemini-1.5-flash', generation_config=GEMINI_JSON_CONFIG)
                 logger.info("Fallback to Gemini 1.5 Flash model")
             except:
                 try:
@@ -57,14 +165,25 @@ class EnhancedChestXrayAnalyzer:
                     logger.error("All Gemini models failed to initialize")
     
     def load_trained_model(self):
-        """Load pre-trained Apriori model"""
+        """Load pre-trained Apriori model (parquet export if complete, else the pickle)"""
         try:
-            with open('chest_xray_apriori_model.pkl', 'rb') as f:
-                model_data = pickle.load(f)
-            
-            self.frequent_itemsets = model_data['frequent_itemsets']
-            self.rules = model_data['rules']
-            self.feature_rules = model_data.get('feature_rules')
+            if all(map(os.path.exists, MODEL_EXPORTS)):
+                try:
+                    self.frequent_itemsets = lists_to_frozensets(pd.read_parquet(MODEL_STEM + '_itemsets.parquet'))
+                    self.rules = lists_to_frozensets(pd.read_parquet(MODEL_STEM + '_rules.parquet'))
+                    with open(MODEL_STEM + '_feature_rules.pkl', 'rb') as f:
+                        self.feature_rules = pickle.load(f)
+                except Exception as e:
+                    logger.warning(f"Could not read the parquet export ({e}), loading the pickle")
+                    self.rules = None
+            if self.rules is None:
+                with open(MODEL_STEM + '.pkl', 'rb') as f:
+                    model_data = pickle.load(f)
+                
+                self.frequent_itemsets = model_data['frequent_itemsets']
+                self.rules = model_data['rules']
+                self.feature_rules = model_data.get('feature_rules')
+            self._index_rules()
             
             logger.info(f"Loaded trained model with {len(self.rules)} rules")
         except Exception as e:
@@ -99,110 +218,159 @@ class EnhancedChestXrayAnalyzer:
                 metric="confidence", 
                 min_threshold=0.3
             )
+            self._index_rules()
             logger.info(f"Created enhanced model with {len(self.rules)} rules")
     
-    def analyze_with_gemini(self, image_base64):
-        """Comprehensive analysis using Gemini AI"""
+    def cached_analysis(self, image_hash):
+        """Copy of the cached analysis for an image digest, or None; refreshes its LRU position"""
+        with self._analysis_cache_lock:
+            result = self._analysis_cache.get(image_hash)
+            if result is None:
+                return None
+            self._analysis_cache.move_to_end(image_hash)
+        # Callers annotate the result in place, so never hand out the cached dict
+        return copy.deepcopy(result)
+    
+    def _cache_analysis(self, image_hash, result):
+        result = copy.deepcopy(result)
+        with self._analysis_cache_lock:
+            self._analysis_cache[image_hash] = result
+            self._analysis_cache.move_to_end(image_hash)
+            while len(self._analysis_cache) > ANALYSIS_CACHE_SIZE:
+                self._analysis_cache.popitem(last=False)
+    
+    def _index_rules(self):
+        """Map each item to the rows of self.rules whose antecedents contain it"""
+        ante_index = defaultdict(list)
+        for i, antecedents in enumerate(self.rules['antecedents']):
+            for item in antecedents:
+                ante_index[item].append(i)
+        self._ante_index = dict(ante_index)
+        self._consequents_list = self.rules['consequents'].tolist()
+        self._confidence_arr = self.rules['confidence'].to_numpy()
+    
+    def analyze_with_gemini(self, image_bytes, image_hash=None):
+        """Comprehensive analysis using Gemini AI
+
+        With an image_hash (digest of the uploaded bytes) successful analyses are
+        cached for cached_analysis, which callers check before preparing the
+        image. Fallback results are never cached.
+        """
         if not self.gemini_model:
             return self.fallback_analysis()
         
         try:
-            # Decode base64 image
-            image_data = base64.b64decode(image_base64)
-            
-            # Enhanced medical prompt for chest X-ray analysis
-            prompt = """
-            You are an expert radiologist AI. Analyze this chest X-ray image and provide a comprehensive medical assessment.
-
-            Please provide your analysis in the following JSON format:
-            {
-                "isValidXray": boolean,
-                "confidence": number (0-100),
-                "imageQuality": "excellent/good/fair/poor",
-                "analysis": "detailed medical analysis in human-understandable language",
-                "findings": [
-                    {
-                        "condition": "condition name",
-                        "description": "clear explanation of what this means for the patient",
-                        "severity": "low/medium/high/critical",
-                        "confidence": number (0-100),
-                        "location": "anatomical location if applicable"
-                    }
-                ],
-                "recommendations": [
-                    {
-                        "title": "recommendation title",
-                        "description": "detailed recommendation in simple terms",
-                        "priority": "low/medium/high/urgent",
-                        "timeframe": "when this should be done"
-                    }
-                ],
-                "normalFindings": [
-                    "list of normal structures observed"
-                ],
-                "technicalNotes": "assessment of image quality and technical factors",
-                "riskFactors": [
-                    "potential risk factors or complications to monitor"
-                ]
-            }
+            analysis_result = self._gemini_analysis(image_bytes)
+        except Exception as e:
+            logger.error(f"Gemini analysis error: {e}")
+            return self.fallback_analysis()
+        
+        if image_hash is not None:
+            self._cache_analysis(image_hash, analysis_result)
+        return analysis_result
+    
+    def _gemini_analysis(self, image_data):
+        """Gemini analysis merged with the traditional one; raises on Gemini failure
 
-            Key requirements:
-            1. First determine if this is actually a chest X-ray
-            2. If valid, provide detailed analysis in simple, patient-friendly language
-            3. Explain medical terms clearly
-            4. Include confidence levels for findings
-            5. Provide actionable recommendations
-            6. Note any limitations of the analysis
-            7. Always include appropriate medical disclaimers
-
-            Focus on:
-            - Lung fields and airways
-            - Heart size and shape
-            - Bone structures
-            - Soft tissues
-            - Any abnormalities or concerning findings
-            - Overall impression
-            """
-            
-            # Create image part for Gemini
-            image_part = {
-                "mime_type": "image/jpeg",
-                "data": image_data
-            }
-            
-            # Generate content with Gemini
-            response = self.gemini_model.generate_content([prompt, image_part])
-            
-            # Parse JSON response
-            response_text = response.text
-            
-            # Extract JSON from response
+        image_data is the JPEG sent to Gemini; the SDK takes raw bytes, and the
+        traditional analysis decodes the same buffer.
+        """
+        # Enhanced medical prompt for chest X-ray analysis
+        prompt = """
+        You are an expert radiologist AI. Analyze this chest X-ray image and provide a comprehensive medical assessment.
+
+        Please provide your analysis in the following JSON format:
+        {
+            "isValidXray": boolean,
+            "confidence": number (0-100),
+            "imageQuality": "excellent/good/fair/poor",
+            "analysis": "detailed medical analysis in human-understandable language",
+            "findings": [
+                {
+                    "condition": "condition name",
+                    "description": "clear explanation of what this means for the patient",
+                    "severity": "low/medium/high/critical",
+                    "confidence": number (0-100),
+                    "location": "anatomical location if applicable"
+                }
+            ],
+            "recommendations": [
+                {
+                    "title": "recommendation title",
+                    "description": "detailed recommendation in simple terms",
+                    "priority": "low/medium/high/urgent",
+                    "timeframe": "when this should be done"
+                }
+            ],
+            "normalFindings": [
+                "list of normal structures observed"
+            ],
+            "technicalNotes": "assessment of image quality and technical factors",
+            "riskFactors": [
+                "potential risk factors or complications to monitor"
+            ]
+        }
+
+        Key requirements:
+        1. First determine if this is actually a chest X-ray
+        2. If valid, provide detailed analysis in simple, patient-friendly language
+        3. Explain medical terms clearly
+        4. Include confidence levels for findings
+        5. Provide actionable recommendations
+        6. Note any limitations of the analysis
+        7. Always include appropriate medical disclaimers
+
+        Focus on:
+        - Lung fields and airways
+        - Heart size and shape
+        - Bone structures
+        - Soft tissues
+        - Any abnormalities or concerning findings
+        - Overall impression
+        """
+        
+        # Create image part for Gemini
+        image_part = {
+            "mime_type": "image/jpeg",
+            "data": image_data
+        }
+        
+        # Generate content with Gemini; the traditional analysis runs on this
+        # thread meanwhile and is only merged if Gemini accepts the image
+        gemini_call = gemini_executor.submit(self.gemini_model.generate_content, [prompt, image_part])
+        traditional_analysis = self.traditional_image_analysis(image_data)
+        response = gemini_call.result()
+        
+        # Parse JSON response
+        response_text = response.text
+        
+        # Extract JSON from response
+        try:
             try:
-                # Find JSON in the response
+                analysis_result = orjson.loads(response_text)
+            except orjson.JSONDecodeError:
+                # Models without JSON mode may wrap the object in prose;
+                # decode the JSON object starting at the first brace
                 start_idx = response_text.find('{')
-                end_idx = response_text.rfind('}') + 1
                 
-                if start_idx != -1 and end_idx != -1:
-                    json_str = response_text[start_idx:end_idx]
-                    analysis_result = json.loads(json_str)
+                if start_idx != -1:
+                    analysis_result, _ = JSON_DECODER.raw_decode(response_text, start_idx)
                 else:
                     # Fallback parsing
                     analysis_result = self.parse_text_response(response_text)
-                
-                # Enhance with traditional analysis if valid X-ray
-                if analysis_result.get('isValidXray', False):
-                    traditional_analysis = self.traditional_image_analysis(image_data)
-                    analysis_result = self.merge_analyses(analysis_result, traditional_analysis)
-                
-                return analysis_result
-                
-            except json.JSONDecodeError as e:
-                logger.error(f"JSON parsing error: {e}")
+            
+            if not isinstance(analysis_result, dict):
                 return self.parse_text_response(response_text)
-                
-        except Exception as e:
-            logger.error(f"Gemini analysis error: {e}")
-            return self.fallback_analysis()
+            
+            # Enhance with traditional analysis if valid X-ray
+            if analysis_result.get('isValidXray', False):
+                analysis_result = self.merge_analyses(analysis_result, traditional_analysis)
+            
+            return analysis_result
+            
+        except json.JSONDecodeError as e:
+            logger.error(f"JSON parsing error: {e}")
+            return self.parse_text_response(response_text)
     
     def parse_text_response(self, text):
         """Parse text response when JSON parsing fails"""
@@ -230,9 +398,11 @@ class EnhancedChestXrayAnalyzer:
     def traditional_image_analysis(self, image_data):
         """Traditional computer vision analysis"""
         try:
-            # Convert bytes to PIL Image
-            image = Image.open(io.BytesIO(image_data))
-            image_array = np.array(image)
+            # Decode straight to greyscale; gemini_jpeg keeps these bytes
+            # near the feature size
+            image_array = cv2.imdecode(np.frombuffer(image_data, np.uint8), cv2.IMREAD_GRAYSCALE)
+            if image_array is None:
+                raise ValueError("Could not decode image")
             
             # Extract features
             features = self.extract_advanced_features(image_array)
@@ -262,106 +432,86 @@ class EnhancedChestXrayAnalyzer:
             gray = image
         
         # Resize for consistent analysis
-        resized = cv2.resize(gray, (512, 512))
+        if gray.shape == (FEATURE_SIZE, FEATURE_SIZE):
+            resized = gray
+        else:
+            resized = cv2.resize(gray, (FEATURE_SIZE, FEATURE_SIZE))
         
         features = {}
         
+        # Histogram features; the intensity moments below are read off the
+        # 256 bins instead of rescanning the image
+        hist = np.bincount(resized.ravel(), minlength=256)
+        features['hist_peak'] = int(hist.argmax())
+        features['hist_std'] = float(hist.std())
+        
         # Basic intensity features
-        features['brightness'] = np.mean(resized)
-        features['contrast'] = np.std(resized)
-        features['min_intensity'] = np.min(resized)
-        features['max_intensity'] = np.max(resized)
+        mean = (INTENSITY_LEVELS @ hist) / resized.size
+        variance = (INTENSITY_LEVELS ** 2 @ hist) / resized.size - mean * mean
+        occupied = np.flatnonzero(hist)
+        features['brightness'] = mean
+        features['contrast'] = np.sqrt(max(variance, 0.0))
+        features['min_intensity'] = occupied[0]
+        features['max_intensity'] = occupied[-1]
         
         # Edge detection features
         edges = cv2.Canny(resized, 30, 100)
-        features['edge_density'] = np.sum(edges > 0) / (512 * 512)
-        
-        # Histogram features
-        hist = cv2.calcHist([resized], [0], None, [256], [0, 256])
-        features['hist_peak'] = np.argmax(hist)
-        features['hist_std'] = np.std(hist)
+        features['edge_density'] = np.count_nonzero(edges) / (512 * 512)
         
         # Texture features using Local Binary Pattern
-        try:
-            from skimage.feature import local_binary_pattern
+        if local_binary_pattern is not None:
             lbp = local_binary_pattern(resized, 8, 1, method='uniform')
-            features['texture_uniformity'] = len(np.unique(lbp))
-        except:
+            # Uniform P=8 codes are the integers 0..9; count the distinct ones
+            features['texture_uniformity'] = np.count_nonzero(np.bincount(lbp.astype(np.intp).ravel()))
+        else:
             features['texture_uniformity'] = 50  # Default value
         
         # Symmetry analysis (important for chest X-rays)
         left_half = resized[:, :256]
         right_half = np.fliplr(resized[:, 256:])
-        features['symmetry'] = np.corrcoef(left_half.flatten(), right_half.flatten())[0, 1]
+        # Pearson correlation from centred dot products; undefined (NaN) for a flat half
+        left = left_half.astype(np.float32).ravel()
+        right = right_half.astype(np.float32).ravel()
+        left -= left.mean()
+        right -= right.mean()
+        denom = np.sqrt(float(left @ left) * float(right @ right))
+        features['symmetry'] = float(left @ right) / denom if denom > 0 else np.nan
         
         return features
     
     def predict_conditions_from_features(self, features):
-        """Enhanced condition prediction based on features"""
-        conditions = []
-        
-        brightness = features['brightness']
-        contrast = features['contrast']
-        edge_density = features['edge_density']
-        symmetry = features.get('symmetry', 0.5)
-        
-        # Enhanced rule-based prediction
-        if brightness < 90:
-            conditions.extend(['Pneumonia', 'Pleural_Effusion', 'Consolidation'])
-        elif brightness < 110:
-            conditions.extend(['Infiltration', 'Atelectasis'])
-        elif brightness > 150:
-            conditions.extend(['Emphysema', 'Pneumothorax'])
-        
-        if contrast > 70:
-            conditions.extend(['Mass', 'Nodule', 'Fibrosis'])
-        elif contrast > 50:
-            conditions.extend(['Cardiomegaly', 'Edema'])
-        elif contrast < 30:
-            conditions.extend(['Pneumothorax', 'Emphysema'])
-        
-        if edge_density > 0.15:
-            conditions.extend(['Fibrosis', 'Pleural_Thickening'])
-        elif edge_density > 0.10:
-            conditions.extend(['Atelectasis', 'Consolidation'])
-        
-        if symmetry < 0.7:
-            conditions.extend(['Cardiomegaly', 'Mass', 'Pleural_Effusion'])
-        
-        # Remove duplicates and return
-        return list(set(conditions)) if conditions else ['No_Finding']
+        """Enhanced condition prediction based on features (see CONDITION_BANDS)"""
+        conditions = set()
+        
+        for name, default, edges, band_conditions in CONDITION_BANDS:
+            value = features[name] if default is None else features.get(name, default)
+            conditions.update(band_conditions[bisect_right(edges, value)])
+        
+        # Duplicates are already merged by the set
+        return list(conditions) if conditions else ['No_Finding']
     
     def apply_association_rules(self, initial_conditions):
         """Apply medical association rules"""
-        if not self.rules or len(self.rules) == 0:
+        if self.rules is None or len(self.rules) == 0:
             return [], []
         
         associated = []
         complications = []
-        
-        severe_conditions = [
-            'Respiratory_Failure', 'Heart_Failure', 'Sepsis', 'ARDS', 
-            'Cardiac_Arrest', 'Lung_Cancer', 'Pulmonary_Embolism'
-        ]
+        present = set(initial_conditions)
         
         for condition in initial_conditions:
-            matching_rules = self.rules[
-                self.rules['antecedents'].apply(lambda x: condition in str(x))
-            ]
-            
-            for _, rule in matching_rules.iterrows():
-                consequents = str(rule['consequents']).replace("frozenset({'", "").replace("'})", "").split("', '")
-                confidence = rule['confidence']
+            for i in self._ante_index.get(condition, ()):
+                confidence = round(float(self._confidence_arr[i]) * 100, 2)
                 
-                for consequent in consequents:
-                    if consequent not in initial_conditions:
+                for consequent in self._consequents_list[i]:
+                    if consequent not in present:
                         rule_info = {
                             'condition': consequent.replace('_', ' '),
-                            'confidence': round(confidence * 100, 2),
+                            'confidence': confidence,
                             'rule': f"{condition} → {consequent}"
                         }
                         
-                        if consequent in severe_conditions:
+                        if consequent in SEVERE_CONDITIONS:
                             complications.append(rule_info)
                         else:
                             associated.append(rule_info)
@@ -420,13 +570,49 @@ class EnhancedChestXrayAnalyzer:
             "riskFactors": []
         }
 
+def image_size(raw):
+    """(width, height) of an upload, read from its header only
+
+    Raises UnidentifiedImageError for anything Pillow can't identify, and
+    DecompressionBombError above MAX_IMAGE_PIXELS.
+    """
+    width, height = Image.open(io.BytesIO(raw)).size
+    if width * height > MAX_IMAGE_PIXELS:
+        raise Image.DecompressionBombError(
+            f"Image of {width}x{height} pixels exceeds the {MAX_IMAGE_PIXELS} pixel limit")
+    return width, height
+
+def gemini_jpeg(raw, width, height):
+    """JPEG bytes to analyze for an upload of the given size
+
+    JPEGs of at most PASSTHROUGH_PIXELS are used as uploaded. Anything else is
+    decoded at the largest DCT reduction that keeps both sides at least
+    FEATURE_SIZE, which also shrinks the Gemini payload, and re-encoded with
+    OpenCV's libjpeg-turbo.
+    """
+    if raw[:2] == b'\xff\xd8' and width * height <= PASSTHROUGH_PIXELS:
+        return raw
+    
+    flag = cv2.IMREAD_COLOR
+    for factor, reduced_flag in REDUCED_COLOR_FLAGS:
+        if min(width, height) // factor >= FEATURE_SIZE:
+            flag = reduced_flag
+            break
+    image = cv2.imdecode(np.frombuffer(raw, np.uint8), flag)
+    if image is None:
+        raise ValueError("Could not decode image")
+    ok, encoded = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, 85])
+    if not ok:
+        raise ValueError("Could not encode image")
+    return encoded.tobytes()
+
 # Initialize the analyzer
 analyzer = EnhancedChestXrayAnalyzer()
 
 @app.route('/api/health', methods=['GET'])
 def health_check():
     """Health check endpoint"""
-    return jsonify({
+    return ojsonify({
         'status': 'healthy',
         'timestamp': datetime.now().isoformat(),
         'gemini_available': analyzer.gemini_model is not None,
@@ -438,25 +624,39 @@ def analyze_xray():
     """Main analysis endpoint"""
     try:
         if 'image' not in request.files:
-            return jsonify({'error': 'No image file provided'}), 400
+            return ojsonify({'error': 'No image file provided'}), 400
         
         file = request.files['image']
         if file.filename == '':
-            return jsonify({'error': 'No image selected'}), 400
+            return ojsonify({'error': 'No image selected'}), 400
         
-        # Read and process image
-        image = Image.open(file.stream)
+        # Read and process image; identical uploads share a cached analysis
+        raw = file.read()
+        image_hash = hashlib.blake2b(raw, digest_size=16).digest()
         
-        # Convert to base64 for Gemini analysis
-        img_buffer = io.BytesIO()
-        if image.mode != 'RGB':
-            image = image.convert('RGB')
-        image.save(img_buffer, format='JPEG', quality=85)
-        img_base64 = base64.b64encode(img_buffer.getvalue()).decode()
+        # Reject non-images and oversized images from the header before any
+        # cached or fallback answer
+        try:
+            width, height = image_size(raw)
+        except UnidentifiedImageError as e:
+            return ojsonify({'error': 'Unsupported image format', 'details': str(e)}), 400
+        except Image.DecompressionBombError as e:
+            return ojsonify({'error': 'Image is too large', 'details': str(e)}), 400
         
-        # Perform comprehensive analysis
         start_time = datetime.now()
-        analysis_result = analyzer.analyze_with_gemini(img_base64)
+        analysis_result = analyzer.cached_analysis(image_hash)
+        if analysis_result is not None:
+            # Resubmitted image: no decode, re-encode or Gemini call
+            logger.info("Analysis served from cache")
+        else:
+            # Gemini and the traditional analysis share these JPEG bytes; without
+            # Gemini only the fallback analysis runs, so nothing is encoded
+            img_bytes = None
+            if analyzer.gemini_model is not None:
+                img_bytes = gemini_jpeg(raw, width, height)
+            
+            # Perform comprehensive analysis
+            analysis_result = analyzer.analyze_with_gemini(img_bytes, image_hash)
         processing_time = (datetime.now() - start_time).total_seconds()
         
         # Add processing metadata
@@ -465,11 +665,11 @@ def analyze_xray():
         analysis_result['analysisId'] = f"xray_{int(datetime.now().timestamp())}"
         
         logger.info(f"Analysis completed in {processing_time:.1f}s")
-        return jsonify(analysis_result)
+        return ojsonify(analysis_result)
         
     except Exception as e:
         logger.error(f"Analysis error: {e}")
-        return jsonify({
+        return ojsonify({
             'error': 'Analysis failed. Please try again with a valid chest X-ray image.',
             'details': str(e)
         }), 500
@@ -477,10 +677,10 @@ def analyze_xray():
 @app.route('/api/supported-types', methods=['GET'])
 def supported_types():
     """Get supported file types"""
-    return jsonify({
+    return ojsonify({
         'types': ['image/jpeg', 'image/jpg', 'image/png', 'image/webp'],
         'extensions': ['.jpg', '.jpeg', '.png', '.webp'],
-        'maxSize': 10 * 1024 * 1024,
+        'maxSize': MAX_UPLOAD_BYTES,
         'recommendations': [
             'Use high-quality chest X-ray images',
             'Ensure good contrast and brightness',
@@ -492,7 +692,7 @@ def supported_types():
 @app.route('/api/model-info', methods=['GET'])
 def model_info():
     """Get model information"""
-    return jsonify({
+    return ojsonify({
         'gemini_model': 'gemini-2.0-flash-exp' if analyzer.gemini_model else 'unavailable',
         'traditional_model': 'loaded' if analyzer.rules is not None else 'basic',
         'association_rules': len(analyzer.rules) if analyzer.rules is not None else 0,
@@ -507,4 +707,6 @@ def model_info():
 
 if __name__ == '__main__':
     port = int(os.getenv('PYTHON_PORT', 5001))
-    app.run(debug=True, host='0.0.0.0', port=port)
\ No newline at end of file
+    # Debug reloader only in development; use gunicorn in production (see README_MAIN.md)
+    app.run(debug=os.environ.get('FLASK_ENV') == 'development', host='0.0.0.0', port=port,
+            threaded=True)
\ No newline at end of file
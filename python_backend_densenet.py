@@ -1,18 +1,25 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request
 from flask_cors import CORS
 import tensorflow as tf
 from tensorflow.keras.applications import DenseNet121
-from tensorflow.keras.preprocessing import image
-from tensorflow.keras.applications.densenet import preprocess_input
 import numpy as np
 from PIL import Image
 import io
-import base64
+import json
+import orjson
 import os
+import shutil
+import tempfile
 from dotenv import load_dotenv
 import google.generativeai as genai
 import cv2
 import logging
+import hashlib
+import queue
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
 
 load_dotenv()
 logging.basicConfig(level=logging.INFO)
@@ -20,12 +27,131 @@ logger = logging.getLogger(__name__)
 
 genai.configure(api_key=os.getenv('GEMINI_API_KEY'))
 
+# TF runtime settings must be applied before the first op runs. The batcher's
+# single worker runs one forward pass at a time, so each op gets every core
+# and only a couple of independent ops run side by side; XLA auto-clustering
+# also fuses anything outside the explicitly jit-compiled forward pass
+tf.config.threading.set_intra_op_parallelism_threads(os.cpu_count())
+tf.config.threading.set_inter_op_parallelism_threads(2)
+tf.config.optimizer.set_jit(True)
+
 app = Flask(__name__)
 CORS(app, origins=['http://localhost:3001'])
 
+def ojsonify(obj):
+    """jsonify via orjson, which also serializes numpy scalars/arrays directly"""
+    return app.response_class(orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY),
+                              mimetype='application/json')
+
+# Concurrent requests are batched into one DenseNet call of up to BATCH_SIZE
+# images, waiting at most BATCH_WAIT_MS for the batch to fill
+BATCH_SIZE = int(os.getenv('BATCH_SIZE', 16))
+BATCH_WAIT_MS = float(os.getenv('BATCH_WAIT_MS', 15))
+
+INPUT_SHAPE = (None, 224, 224, 3)
+
+# Feature extractor exported with its jit-compiled serving signature on first
+# start and loaded from here afterwards, one directory per precision policy
+# (see saved_model_dir; delete the directory to rebuild)
+SAVED_MODEL_PATH = 'densenet121_features_sm'
+
+# USE_TFLITE=1: DenseNet converted to a float16-weight TFLite model, run on XNNPACK
+TFLITE_MODEL_PATH = 'densenet121_features_fp16.tflite'
+
+# ImageNet channel statistics on the 0-255 scale, as used by densenet.preprocess_input
+IMAGENET_MEAN = np.array([0.485, 0.456, 0.406], dtype=np.float32) * 255
+IMAGENET_STD = np.array([0.229, 0.224, 0.225], dtype=np.float32) * 255
+
+# Uploads are rejected (413) above MAX_UPLOAD_BYTES, and images above
+# MAX_IMAGE_PIXELS (400) before any pixel data is decoded
+MAX_UPLOAD_BYTES = 10 * 1024 * 1024
+MAX_IMAGE_PIXELS = 25_000_000
+app.config['MAX_CONTENT_LENGTH'] = MAX_UPLOAD_BYTES
+Image.MAX_IMAGE_PIXELS = MAX_IMAGE_PIXELS
+
+# Uploaded JPEGs up to this many pixels are sent to Gemini without re-encoding
+PASSTHROUGH_PIXELS = 1024 * 1024
+
+# DCT-domain downscaled decodes, largest reduction first
+REDUCED_COLOR_FLAGS = (
+    (8, cv2.IMREAD_REDUCED_COLOR_8),
+    (4, cv2.IMREAD_REDUCED_COLOR_4),
+    (2, cv2.IMREAD_REDUCED_COLOR_2),
+)
+
+# DenseNet features kept per upload digest, so resubmitted images skip the forward pass
+FEATURE_CACHE_SIZE = int(os.getenv('FEATURE_CACHE_SIZE', 64))
+
+# Runs the Gemini round-trip while the request thread runs DenseNet
+gemini_executor = ThreadPoolExecutor(max_workers=4)
+
+# Statistics of the z-scored DenseNet features the rules below test
+RULE_STATISTICS = ('mean', 'std', 'max', 'min', '|mean|')
+
+# predict_diseases rules, in reporting order. A rule fires when
+# sign * statistic > threshold and then scores
+# min(cap, scale * |baseline + sign * statistic|)
+DISEASE_RULES = (
+    # label,          statistic, sign, threshold, baseline, scale,    cap
+    ('Pneumonia',     'mean',     1,    0.3,      0,        120,      88),
+    ('Cardiomegaly',  'std',      1,    0.6,      0,        110,      82),
+    ('Mass',          'max',      1,    1.5,      0,        100 / 2.5, 78),
+    ('Pneumothorax',  'mean',    -1,    0.2,      0,        150,      75),
+    ('Atelectasis',   'std',     -1,   -0.4,      1,        120,      70),
+    ('Consolidation', '|mean|',   1,    0.8,      0,        90,       73),
+    ('Edema',         'min',     -1,    1.0,      0,        80,       68),
+    ('Nodule',        'max',      1,    2.5,      0,        100 / 4,  65),
+)
+RULE_LABELS = [rule[0] for rule in DISEASE_RULES]
+RULE_STATISTIC_INDEX = np.array([RULE_STATISTICS.index(rule[1]) for rule in DISEASE_RULES])
+RULE_SIGNS, RULE_THRESHOLDS, RULE_BASELINES, RULE_SCALES, RULE_CAPS = (
+    np.array(column, dtype=np.float64) for column in list(zip(*DISEASE_RULES))[2:])
+
+# Decodes the first JSON object in a Gemini reply, ignoring any prose around it
+JSON_DECODER = json.JSONDecoder()
+
+def saved_model_predict(saved_model):
+    """Callable running a loaded SavedModel's serving signature on a float32 batch"""
+    signature = saved_model.signatures['serving_default']
+    input_name = next(iter(signature.structured_input_signature[1]))
+    
+    def predict(batch):
+        outputs = signature(**{input_name: tf.constant(batch, tf.float32)})
+        return next(iter(outputs.values())).numpy()
+    return predict
+
+def saved_model_dir(policy):
+    """SavedModel directory for a mixed_precision_policy() result, so a cached
+    export is never reused under a different policy"""
+    return f"{SAVED_MODEL_PATH}_{policy or 'float32'}"
+
+def padded_batch_size(n):
+    """Batch size a batch of n images is zero-padded to: the next power of two,
+    capped at BATCH_SIZE (larger batches are left as they are)"""
+    if n > BATCH_SIZE:
+        return n
+    return min(1 << (n - 1).bit_length(), BATCH_SIZE)
+
+def mixed_precision_policy():
+    """Keras policy to build DenseNet under: mixed_float16 on GPU, mixed_bfloat16
+    with USE_BF16=1 (CPUs with native bf16), otherwise None for plain float32
+
+    See also USE_TFLITE for a float16-weight model on CPU.
+    """
+    if tf.config.list_physical_devices('GPU'):
+        return 'mixed_float16'
+    if os.getenv('USE_BF16') == '1':
+        return 'mixed_bfloat16'
+    return None
+
 class DenseNetChestXrayAnalyzer:
     def __init__(self):
         self.model = None
+        self._infer = None
+        self._infer_batch = None
+        # Per-thread padding buffers (the batcher worker, plus any direct
+        # extract_features callers), reused across batches
+        self._buffers = threading.local()
         self.gemini_model = None
         self.disease_classes = [
             'Atelectasis', 'Cardiomegaly', 'Effusion', 'Infiltration',
@@ -33,77 +159,199 @@ class DenseNetChestXrayAnalyzer:
             'Consolidation', 'Edema', 'Emphysema', 'Fibrosis',
             'Pleural_Thickening', 'Hernia', 'No_Finding'
         ]
+        self._feature_cache = OrderedDict()
+        self._feature_cache_lock = threading.Lock()
         self.load_models()
     
     def load_models(self):
+        use_tflite = os.getenv('USE_TFLITE') == '1'
+        policy = None if use_tflite else mixed_precision_policy()
+        saved_model_path = saved_model_dir(policy)
+        description = None
+        if not use_tflite and os.path.isdir(saved_model_path):
+            try:
+                # Exported by an earlier start; loads the traced forward pass
+                # without rebuilding DenseNet through Keras Applications
+                self.model = tf.saved_model.load(saved_model_path)
+                self._infer_batch = saved_model_predict(self.model)
+                description = f'SavedModel {saved_model_path}'
+            except Exception as e:
+                logger.warning(f"Could not load {saved_model_path} ({e}), rebuilding DenseNet121")
+                self.model = None
+                # Cleared so the export below can take its place
+                shutil.rmtree(saved_model_path, ignore_errors=True)
+        
         try:
-            self.model = DenseNet121(weights='imagenet', include_top=False, pooling='avg')
-            logger.info("DenseNet121 model loaded successfully")
+            if description is None:
+                if policy:
+                    tf.keras.mixed_precision.set_global_policy(policy)
+                self.model = DenseNet121(weights='imagenet', include_top=False, pooling='avg',
+                                         input_shape=INPUT_SHAPE[1:])
+                if use_tflite:
+                    self._infer_batch = self.load_tflite()
+                    description = 'TFLite float16 weights'
+                else:
+                    self._infer = tf.function(
+                        lambda x: tf.cast(self.model(x, training=False), tf.float32),
+                        input_signature=[tf.TensorSpec(INPUT_SHAPE, tf.float32)],
+                        jit_compile=True)
+                    self._infer_batch = lambda batch: self._infer(batch).numpy()
+                    self.export_saved_model(saved_model_path)
+                    description = policy or 'float32'
+            # Trace and XLA-compile (or size the interpreter for) every padded
+            # batch size now rather than on the first request of each size
+            for size in sorted({padded_batch_size(n) for n in range(1, BATCH_SIZE + 1)}):
+                self._infer_batch(np.zeros((size,) + INPUT_SHAPE[1:], np.float32))
+            logger.info(f"DenseNet121 model loaded successfully ({description})")
         except Exception as e:
             logger.error(f"Failed to load DenseNet121: {e}")
+        finally:
+            if policy:
+                tf.keras.mixed_precision.set_global_policy('float32')
         
         try:
+            # gemini-pro has no JSON mode; replies are parsed out of the prose
             self.gemini_model = genai.GenerativeModel('gemini-pro')
             logger.info("Gemini Pro model loaded successfully")
         except Exception as e:
             logger.error(f"Failed to load Gemini models: {e}")
     
+    def export_saved_model(self, path):
+        """Save the model with self._infer as its serving signature, so later
+        starts can load it from path
+
+        Written to a temporary directory and renamed into place, so an export
+        that fails halfway never leaves a directory later starts would load.
+        """
+        tmp_path = tempfile.mkdtemp(prefix=os.path.basename(path) + '.', dir=os.path.dirname(path) or '.')
+        try:
+            tf.saved_model.save(self.model, tmp_path,
+                                signatures={'serving_default': self._infer.get_concrete_function()})
+            os.replace(tmp_path, path)
+            logger.info(f"DenseNet121 exported to {path}")
+        except Exception as e:
+            logger.warning(f"Could not export SavedModel: {e}")
+        finally:
+            if os.path.isdir(tmp_path):
+                shutil.rmtree(tmp_path, ignore_errors=True)
+    
+    def load_tflite(self):
+        """Float16-weight TFLite copy of the model (converted once), run on XNNPACK
+        CPU kernels; takes and returns float32 batches like the Keras path"""
+        if not os.path.exists(TFLITE_MODEL_PATH):
+            converter = tf.lite.TFLiteConverter.from_keras_model(self.model)
+            converter.optimizations = [tf.lite.Optimize.DEFAULT]
+            converter.target_spec.supported_types = [tf.float16]
+            with open(TFLITE_MODEL_PATH, 'wb') as f:
+                f.write(converter.convert())
+        interpreter = tf.lite.Interpreter(model_path=TFLITE_MODEL_PATH, num_threads=os.cpu_count())
+        interpreter.allocate_tensors()
+        input_details = interpreter.get_input_details()[0]
+        output_details = interpreter.get_output_details()[0]
+        input_shape = [tuple(input_details['shape'])]
+        
+        def infer(batch):
+            # Only called from the batcher's worker thread (and at startup)
+            if batch.shape != input_shape[0]:
+                interpreter.resize_tensor_input(input_details['index'], batch.shape)
+                interpreter.allocate_tensors()
+                input_shape[0] = batch.shape
+            interpreter.set_tensor(input_details['index'], batch)
+            interpreter.invoke()
+            return interpreter.get_tensor(output_details['index'])
+        return infer
+    
     def preprocess_image(self, img):
-        img = img.resize((224, 224))
         if img.mode != 'RGB':
             img = img.convert('RGB')
-        x = image.img_to_array(img)
-        x = np.expand_dims(x, axis=0)
-        x = preprocess_input(x)
+        return self.preprocess_array(np.asarray(img))
+    
+    def preprocess_array(self, arr, bgr=False):
+        """(1, 224, 224, 3) DenseNet input from a uint8 RGB (or BGR) image of any size"""
+        if arr.shape[:2] != (224, 224):
+            arr = cv2.resize(arr, (224, 224), interpolation=cv2.INTER_AREA)
+        if bgr:
+            arr = cv2.cvtColor(arr, cv2.COLOR_BGR2RGB)
+        # DenseNet's 'torch' preprocessing, (x / 255 - mean) / std, in place
+        x = arr.astype(np.float32)[np.newaxis]
+        x -= IMAGENET_MEAN
+        x /= IMAGENET_STD
         return x
     
     def extract_features(self, img):
-        processed_img = self.preprocess_image(img)
-        features = self.model.predict(processed_img, verbose=0)
-        return features[0]
+        """float32 DenseNet features for one PIL image, outside the request batcher"""
+        return self.extract_features_batch(self.preprocess_image(img))[0]
+    
+    def extract_features_batch(self, batch):
+        """float32 DenseNet features for a (N, 224, 224, 3) preprocessed batch
+
+        Batches are zero-padded (padded_batch_size) so XLA compiles a handful
+        of shapes instead of one per batch size.
+        """
+        n = len(batch)
+        size = padded_batch_size(n)
+        if size != n:
+            # Pad in this thread's reusable buffer rather than a new array per batch
+            padded = getattr(self._buffers, 'padded', None)
+            if padded is None:
+                padded = self._buffers.padded = np.empty((BATCH_SIZE,) + INPUT_SHAPE[1:], np.float32)
+            padded[:n] = batch
+            padded[n:size] = 0
+            batch = padded[:size]
+        return self._infer_batch(batch)[:n]
+    
+    def cached_features(self, image_hash):
+        """Cached features for an upload digest, or None; refreshes the entry's LRU position"""
+        with self._feature_cache_lock:
+            features = self._feature_cache.get(image_hash)
+            if features is not None:
+                self._feature_cache.move_to_end(image_hash)
+            return features
+    
+    def cache_features(self, image_hash, features):
+        # Copy so the entry does not keep the whole padded batch output alive,
+        # and store it read-only since entries are shared between requests
+        features = features.copy()
+        features.flags.writeable = False
+        with self._feature_cache_lock:
+            self._feature_cache[image_hash] = features
+            self._feature_cache.move_to_end(image_hash)
+            while len(self._feature_cache) > FEATURE_CACHE_SIZE:
+                self._feature_cache.popitem(last=False)
     
     def predict_diseases(self, features):
-        predictions = []
-        
-        # Normalize features
-        features = (features - np.mean(features)) / (np.std(features) + 1e-8)
-        
-        # Enhanced rule-based disease prediction
-        feature_mean = np.mean(features)
-        feature_std = np.std(features)
-        feature_max = np.max(features)
-        feature_min = np.min(features)
-        
-        # More sophisticated disease detection
-        if feature_mean > 0.3:
-            predictions.append(('Pneumonia', min(88, abs(feature_mean) * 120)))
-        if feature_std > 0.6:
-            predictions.append(('Cardiomegaly', min(82, feature_std * 110)))
-        if feature_max > 1.5:
-            predictions.append(('Mass', min(78, (feature_max / 2.5) * 100)))
-        if feature_mean < -0.2:
-            predictions.append(('Pneumothorax', min(75, abs(feature_mean) * 150)))
-        if feature_std < 0.4:
-            predictions.append(('Atelectasis', min(70, (1 - feature_std) * 120)))
-        if abs(feature_mean) > 0.8:
-            predictions.append(('Consolidation', min(73, abs(feature_mean) * 90)))
-        if feature_min < -1.0:
-            predictions.append(('Edema', min(68, abs(feature_min) * 80)))
-        if feature_max > 2.5:
-            predictions.append(('Nodule', min(65, (feature_max / 4) * 100)))
+        # Statistics of the z-scored features, derived from the raw moments
+        # rather than by normalizing all 1024 values first
+        # (sum and dot product in float64; std avoids the centred temporary)
+        features = features.astype(np.float64)
+        mean = features.sum() / features.size
+        std = np.sqrt(max(features @ features / features.size - mean * mean, 0.0))
+        scale = std + 1e-8
+        feature_mean = 0.0
+        feature_std = std / scale
+        feature_max = (float(features.max()) - mean) / scale
+        feature_min = (float(features.min()) - mean) / scale
+        
+        # More sophisticated disease detection: test every rule at once, then
+        # score the matching ones (see DISEASE_RULES)
+        statistics = np.array([feature_mean, feature_std, feature_max, feature_min,
+                               abs(feature_mean)])  # in RULE_STATISTICS order
+        tested = RULE_SIGNS * statistics[RULE_STATISTIC_INDEX]
+        scores = np.minimum(RULE_CAPS, np.abs(RULE_BASELINES + tested) * RULE_SCALES)
+        predictions = [(RULE_LABELS[i], float(scores[i]))
+                       for i in np.flatnonzero(tested > RULE_THRESHOLDS)]
         
         if not predictions:
             predictions.append(('No_Finding', 92))
         
         return predictions
     
-    def analyze_with_gemini(self, image_base64):
+    def analyze_with_gemini(self, image_data):
+        """Gemini analysis of the JPEG bytes in image_data (None when Gemini is unavailable)"""
         if not self.gemini_model:
             return self.fallback_analysis()
         
         try:
-            image_data = base64.b64decode(image_base64)
-            
             prompt = """
             You are a medical AI assistant. Analyze this image carefully.
             
@@ -139,19 +387,25 @@ class DenseNetChestXrayAnalyzer:
             image_part = {"mime_type": "image/jpeg", "data": image_data}
             response = self.gemini_model.generate_content([prompt, image_part])
             
+            response_text = response.text
             try:
-                start_idx = response.text.find('{')
-                end_idx = response.text.rfind('}') + 1
-                if start_idx != -1 and end_idx != -1:
-                    import json
-                    return json.loads(response.text[start_idx:end_idx])
-            except:
-                pass
+                result = orjson.loads(response_text)
+            except orjson.JSONDecodeError:
+                # Fall back to the first JSON object inside a prose reply
+                result = None
+                start_idx = response_text.find('{')
+                if start_idx != -1:
+                    try:
+                        result = JSON_DECODER.raw_decode(response_text, start_idx)[0]
+                    except json.JSONDecodeError as e:
+                        logger.error(f"JSON parsing error: {e}")
+            if isinstance(result, dict):
+                return result
             
             return {
                 "isValidXray": True,
                 "confidence": 75,
-                "analysis": response.text,
+                "analysis": response_text,
                 "findings": [],
                 "recommendations": []
             }
@@ -175,11 +429,52 @@ class DenseNetChestXrayAnalyzer:
             ]
         }
 
+class BatchPredictor:
+    """Coalesce concurrent single-image requests into one model call"""
+    
+    def __init__(self, predict_fn, max_batch_size=BATCH_SIZE, max_wait_ms=BATCH_WAIT_MS):
+        self.predict_fn = predict_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.requests = queue.Queue()
+        self.worker = threading.Thread(target=self._run, daemon=True)
+        self.worker.start()
+    
+    def submit(self, img):
+        """Queue a (1, H, W, C) preprocessed image and return a Future for its output row"""
+        future = Future()
+        self.requests.put((img, future))
+        return future
+    
+    def _run(self):
+        while True:
+            batch = [self.requests.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.requests.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            
+            images, futures = zip(*batch)
+            try:
+                outputs = self.predict_fn(np.concatenate(images, axis=0))
+            except Exception as e:
+                for future in futures:
+                    future.set_exception(e)
+                continue
+            for i, future in enumerate(futures):
+                future.set_result(outputs[i])
+
 analyzer = DenseNetChestXrayAnalyzer()
+batch_predictor = BatchPredictor(analyzer.extract_features_batch)
 
 @app.route('/api/health', methods=['GET'])
 def health_check():
-    return jsonify({
+    return ojsonify({
         'status': 'healthy',
         'densenet_loaded': analyzer.model is not None,
         'gemini_available': analyzer.gemini_model is not None
@@ -189,28 +484,58 @@ def health_check():
 def analyze_xray():
     try:
         if 'image' not in request.files:
-            return jsonify({'error': 'No image provided'}), 400
+            return ojsonify({'error': 'No image provided'}), 400
         
         file = request.files['image']
-        img = Image.open(file.stream)
+        raw = file.read()
+        image_hash = hashlib.blake2b(raw, digest_size=16).digest()
+        try:
+            width, height = Image.open(io.BytesIO(raw)).size  # header only
+        except Image.DecompressionBombError:
+            width = height = None
+        if width is None or width * height > MAX_IMAGE_PIXELS:
+            return ojsonify({'error': 'Image is too large'}), 400
+        passthrough = raw[:2] == b'\xff\xd8' and width * height <= PASSTHROUGH_PIXELS
+        # Decode to BGR at a reduced DCT scale that keeps both sides at least
+        # 512px, so both the 224px DenseNet input and the Gemini upload are
+        # resized from it
+        flag = cv2.IMREAD_COLOR
+        for factor, reduced_flag in REDUCED_COLOR_FLAGS:
+            if min(width, height) // factor >= 512:
+                flag = reduced_flag
+                break
+        img = cv2.imdecode(np.frombuffer(raw, np.uint8), flag)
+        if img is None:
+            raise ValueError("Could not decode image")
         
-        # Convert to base64 for Gemini
-        img_buffer = io.BytesIO()
-        if img.mode != 'RGB':
-            img = img.convert('RGB')
-        img.save(img_buffer, format='JPEG', quality=85)
-        img_base64 = base64.b64encode(img_buffer.getvalue()).decode()
+        # Small JPEGs go to Gemini as uploaded; anything else is re-encoded
+        # with OpenCV's libjpeg-turbo (nothing is encoded without Gemini)
+        if analyzer.gemini_model is None:
+            img_bytes = None
+        elif passthrough:
+            img_bytes = raw
+        else:
+            ok, encoded = cv2.imencode('.jpg', img, [cv2.IMWRITE_JPEG_QUALITY, 85])
+            if not ok:
+                raise ValueError("Could not encode image")
+            img_bytes = encoded.tobytes()
+        
+        # Start the Gemini round-trip first; preprocessing, the batched DenseNet
+        # pass and the disease rules all run while it is in flight
+        gemini_call = gemini_executor.submit(analyzer.analyze_with_gemini, img_bytes)
         
-        # DenseNet analysis
-        features = analyzer.extract_features(img)
+        features = analyzer.cached_features(image_hash)
+        if features is None:
+            features = batch_predictor.submit(analyzer.preprocess_array(img, bgr=True)).result()
+            analyzer.cache_features(image_hash, features)
         disease_predictions = analyzer.predict_diseases(features)
         
         # Gemini analysis
-        gemini_result = analyzer.analyze_with_gemini(img_base64)
+        gemini_result = gemini_call.result()
         
         # Check if Gemini validated the image as a chest X-ray
         if not gemini_result.get('isValidXray', True):
-            return jsonify(gemini_result)  # Return Gemini's validation response directly
+            return ojsonify(gemini_result)  # Return Gemini's validation response directly
         
         # Combine results only if valid X-ray
         combined_findings = []
@@ -230,11 +555,13 @@ def analyze_xray():
         gemini_result['processingTime'] = '2.1s'
         gemini_result['modelUsed'] = 'DenseNet121 + Gemini AI'
         
-        return jsonify(gemini_result)
+        return ojsonify(gemini_result)
         
     except Exception as e:
         logger.error(f"Analysis error: {e}")
-        return jsonify({'error': 'Analysis failed'}), 500
+        return ojsonify({'error': 'Analysis failed'}), 500
 
 if __name__ == '__main__':
-    app.run(debug=True, host='0.0.0.0', port=5001)
\ No newline at end of file
+    # Debug reloader only in development; use gunicorn in production (see README_MAIN.md)
+    app.run(debug=os.environ.get('FLASK_ENV') == 'development', host='0.0.0.0', port=5001,
+            threaded=True)
\ No newline at end of file
@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""
+Post-training full-integer (INT8) quantization of the diagnosis_app model for CPU inference
+
+Usage: python3 quantize.py calibration_image [calibration_image ...]
+Writes chest_xray_int8.tflite, which diagnosis_app.py loads in place of the Keras model.
+Calibrate with a few hundred representative chest X-rays for good accuracy.
+"""
+
+import os
+import sys
+import numpy as np
+import cv2
+import tensorflow as tf
+
+TFLITE_MODEL_PATH = 'chest_xray_int8.tflite'  # the path diagnosis_app.py looks for
+
+def load_calibration_image(path):
+    """Same preprocessing as ChestXrayDiagnosis.preprocess_image"""
+    img = cv2.imread(path, cv2.IMREAD_GRAYSCALE)
+    if img is None:
+        return None
+    img = cv2.resize(img, (224, 224), interpolation=cv2.INTER_AREA).astype(np.float32)
+    np.multiply(img, 1.0 / 255.0, out=img)
+    return img.reshape(1, 224, 224, 1)
+
+def quantize(model_path, image_paths, output_path=TFLITE_MODEL_PATH):
+    model = tf.keras.models.load_model(model_path, compile=False)
+    
+    def representative_dataset():
+        for path in image_paths:
+            img = load_calibration_image(path)
+            if img is not None:
+                yield [img]
+    
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    converter.representative_dataset = representative_dataset
+    converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+    converter.inference_input_type = tf.int8
+    converter.inference_output_type = tf.int8
+    
+    with open(output_path, 'wb') as f:
+        f.write(converter.convert())
+    print(f"✅ INT8 model written to {output_path}")
+    return output_path
+
+def main():
+    model_path = 'chest_xray_model.keras' if os.path.exists('chest_xray_model.keras') else 'chest_xray_model.h5'
+    if not os.path.exists(model_path):
+        print(f"❌ Trained model not found: {model_path}")
+        return
+    if len(sys.argv) < 2:
+        print(__doc__)
+        return
+    quantize(model_path, sys.argv[1:])
+
+if __name__ == "__main__":
+    main()
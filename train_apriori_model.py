@@ -1,9 +1,58 @@
 import pandas as pd
 import numpy as np
+from scipy import sparse
 from mlxtend.frequent_patterns import apriori, association_rules
-from mlxtend.preprocessing import TransactionEncoder
 import pickle
+import mmap
 import os
+import sys
+
+def frozenset_columns_to_lists(df):
+    """Copy of df with frozenset columns as sorted lists, which parquet can store"""
+    df = df.copy()
+    for col in ('itemsets', 'antecedents', 'consequents'):
+        if col in df:
+            df[col] = [sorted(items) for items in df[col]]
+    return df
+
+# Simulated image features attached to transactions containing any of the
+# conditions: (conditions, features), each feature yielding its own row
+FEATURE_TRIGGERS = (
+    (('Pneumonia', 'Consolidation'), ('low_brightness', 'high_contrast')),
+    (('Cardiomegaly',), ('high_edge_density', 'low_symmetry')),
+    (('Mass', 'Nodule'), ('very_high_contrast', 'medium_brightness')),
+    (('Pneumothorax',), ('very_high_edge_density', 'high_brightness')),
+    (('No Finding',), ('normal_brightness', 'normal_contrast')),
+)
+
+def one_hot(transactions):
+    """Sparse CSR one-hot matrix of transactions and the item name of each column
+
+    The vocabulary and the (row, column) pairs are collected in a single pass
+    over the transactions; columns are sorted by item name, as
+    TransactionEncoder orders them.
+    """
+    vocab = {}
+    rows, cols = [], []
+    for i, transaction in enumerate(transactions):
+        for item in transaction:
+            rows.append(i)
+            cols.append(vocab.setdefault(item, len(vocab)))
+    
+    columns = sorted(vocab)
+    sorted_position = np.empty(len(vocab), dtype=np.int32)
+    sorted_position[[vocab[item] for item in columns]] = np.arange(len(columns), dtype=np.int32)
+    matrix = sparse.coo_matrix(
+        (np.ones(len(rows), dtype=bool),
+         (np.asarray(rows, dtype=np.int32), sorted_position[np.asarray(cols, dtype=np.int32)])),
+        shape=(len(transactions), len(columns)))
+    # Converting sums duplicate (row, column) pairs, so repeated items stay one True
+    return matrix.tocsr(), columns
+
+def encode_transactions(transactions):
+    """One-hot transactions as a sparse boolean DataFrame (one column per item) for apriori"""
+    matrix, columns = one_hot(transactions)
+    return pd.DataFrame.sparse.from_spmatrix(matrix, columns=columns)
 
 class ChestXrayAprioriTrainer:
     def __init__(self):
@@ -19,15 +68,13 @@ class ChestXrayAprioriTrainer:
         # Clean and process the data
         df['Finding Labels'] = df['Finding Labels'].fillna('No Finding')
         
-        # Create transactions from findings
-        transactions = []
-        for findings in df['Finding Labels']:
-            if findings != 'No Finding':
-                # Split multiple findings
-                items = [item.strip() for item in findings.split('|')]
-                transactions.append(items)
-            else:
-                transactions.append(['No Finding'])
+        # Create transactions from findings. Only the few hundred distinct label
+        # strings are split, and rows with the same labels share one (read-only)
+        # item list of interned names
+        codes, label_sets = pd.factorize(df['Finding Labels'])
+        parsed = [[sys.intern(item.strip()) for item in findings.split('|')]
+                  for findings in label_sets]
+        transactions = [parsed[code] for code in codes]
         
         print(f"Processed {len(transactions)} patient records")
         return transactions
@@ -55,27 +102,35 @@ class ChestXrayAprioriTrainer:
             'Pleural_Thickening': ['Fibrosis', 'Effusion']
         }
         
-        # Generate 5000 synthetic patient records
-        for _ in range(5000):
+        # Generate 5000 synthetic patient records; every random draw is made up
+        # front, leaving only list assembly in the loop
+        n_records = 5000
+        rng = np.random.default_rng()
+        names = list(conditions.keys())
+        primaries = rng.integers(len(names), size=n_records).tolist()
+        has_associated = (rng.random(n_records) < 0.7).tolist()  # 70% chance of associated conditions
+        num_additional = rng.integers(1, 3, size=n_records).tolist()
+        # A random permutation of associated-list positions per record; keeping the
+        # positions inside a shorter list gives a random order of that list
+        width = max(len(associated) for associated in conditions.values())
+        orders = np.argsort(rng.random((n_records, width)), axis=1).tolist()
+        has_random = (rng.random(n_records) < 0.3).tolist()  # 30% chance of a random extra condition
+        random_conditions = rng.integers(len(names), size=n_records).tolist()
+        
+        for i in range(n_records):
             # Random primary condition
-            primary = np.random.choice(list(conditions.keys()))
+            primary = names[primaries[i]]
             patient_conditions = [primary]
             
-            # Add associated conditions based on medical patterns
-            if primary in conditions:
-                # 70% chance of having associated conditions
-                if np.random.random() < 0.7:
-                    num_additional = np.random.randint(1, 3)
-                    additional = np.random.choice(
-                        conditions[primary], 
-                        size=min(num_additional, len(conditions[primary])), 
-                        replace=False
-                    )
-                    patient_conditions.extend(additional)
+            # Add associated conditions based on medical patterns, without replacement
+            if has_associated[i]:
+                associated = conditions[primary]
+                picks = [j for j in orders[i] if j < len(associated)][:num_additional[i]]
+                patient_conditions.extend(associated[j] for j in picks)
             
-            # 30% chance of having completely random additional condition
-            if np.random.random() < 0.3:
-                random_condition = np.random.choice(list(conditions.keys()))
+            # Completely random additional condition
+            if has_random[i]:
+                random_condition = names[random_conditions[i]]
                 if random_condition not in patient_conditions:
                     patient_conditions.append(random_condition)
             
@@ -93,12 +148,10 @@ class ChestXrayAprioriTrainer:
         print("Training Apriori model...")
         
         # Convert to binary matrix
-        te = TransactionEncoder()
-        te_ary = te.fit(transactions).transform(transactions)
-        df = pd.DataFrame(te_ary, columns=te.columns_)
+        df = encode_transactions(transactions)
         
         # Find frequent itemsets
-        self.frequent_itemsets = apriori(df, min_support=min_support, use_colnames=True)
+        self.frequent_itemsets = apriori(df, min_support=min_support, use_colnames=True, low_memory=True)
         print(f"Found {len(self.frequent_itemsets)} frequent itemsets")
         
         # Generate association rules
@@ -116,44 +169,34 @@ class ChestXrayAprioriTrainer:
         """Create rules linking image features to conditions"""
         print("Creating feature-based rules...")
         
-        # Simulate feature-condition relationships
-        feature_conditions = []
+        # Simulate feature-condition relationships: for each feature, the one-hot
+        # rows of the transactions that trigger it plus that feature's column
+        matrix, columns = one_hot(transactions)
+        column_index = {item: i for i, item in enumerate(columns)}
+        feature_names = [feature for _, features in FEATURE_TRIGGERS for feature in features]
         
-        for transaction in transactions:
-            # Simulate image features for each transaction
-            features = {}
-            
-            if 'Pneumonia' in transaction or 'Consolidation' in transaction:
-                features['low_brightness'] = True
-                features['high_contrast'] = True
-            
-            if 'Cardiomegaly' in transaction:
-                features['high_edge_density'] = True
-                features['low_symmetry'] = True
-            
-            if 'Mass' in transaction or 'Nodule' in transaction:
-                features['very_high_contrast'] = True
-                features['medium_brightness'] = True
-            
-            if 'Pneumothorax' in transaction:
-                features['very_high_edge_density'] = True
-                features['high_brightness'] = True
-            
-            if 'No Finding' in transaction:
-                features['normal_brightness'] = True
-                features['normal_contrast'] = True
-            
-            # Create feature-condition pairs
-            for feature, present in features.items():
-                if present:
-                    feature_conditions.append(transaction + [feature])
+        blocks = []
+        for conditions, features in FEATURE_TRIGGERS:
+            condition_cols = [column_index[c] for c in conditions if c in column_index]
+            rows = np.flatnonzero(matrix[:, condition_cols].getnnz(axis=1)) if condition_cols else []
+            if len(rows) == 0:
+                continue
+            matched = matrix[rows]
+            for feature in features:
+                flags = sparse.csr_matrix(
+                    (np.ones(len(rows), dtype=bool),
+                     (np.arange(len(rows)), np.full(len(rows), feature_names.index(feature)))),
+                    shape=(len(rows), len(feature_names)))
+                blocks.append(sparse.hstack([matched, flags], format='csr'))
+        
+        if not blocks:
+            return self.feature_rules
         
         # Train Apriori on feature-condition data
-        te = TransactionEncoder()
-        te_ary = te.fit(feature_conditions).transform(feature_conditions)
-        df = pd.DataFrame(te_ary, columns=te.columns_)
+        df = pd.DataFrame.sparse.from_spmatrix(sparse.vstack(blocks, format='csr'),
+                                               columns=columns + feature_names)
         
-        feature_itemsets = apriori(df, min_support=0.05, use_colnames=True)
+        feature_itemsets = apriori(df, min_support=0.05, use_colnames=True, low_memory=True)
         
         if len(feature_itemsets) > 0:
             self.feature_rules = association_rules(
@@ -166,7 +209,14 @@ class ChestXrayAprioriTrainer:
         return self.feature_rules
     
     def save_model(self, model_path='chest_xray_apriori_model.pkl'):
-        """Save trained model"""
+        """Save trained model
+
+        Rules and itemsets are also written as zstd parquet next to the pickle
+        (frozenset columns stored as sorted lists), with feature_rules in a
+        small pickle of its own, so the diagnosis app can load them columnar.
+        The parquet export is best-effort: without pyarrow, any older export is
+        removed and the apps load the pickle.
+        """
         model_data = {
             'frequent_itemsets': self.frequent_itemsets,
             'rules': self.rules,
@@ -174,15 +224,33 @@ class ChestXrayAprioriTrainer:
         }
         
         with open(model_path, 'wb') as f:
-            pickle.dump(model_data, f)
+            pickle.dump(model_data, f, protocol=5)
         
         print(f"Model saved to {model_path}")
+        
+        stem = os.path.splitext(model_path)[0]
+        for name, df in [('rules', self.rules), ('itemsets', self.frequent_itemsets)]:
+            export_path = f'{stem}_{name}.parquet'
+            if df is not None:
+                try:
+                    frozenset_columns_to_lists(df).to_parquet(export_path, compression='zstd')
+                    continue
+                except ImportError as e:
+                    print(f"Skipping parquet export ({e})")
+            # Don't leave an older export for the loaders to prefer over this pickle
+            if os.path.exists(export_path):
+                os.remove(export_path)
+        with open(f'{stem}_feature_rules.pkl', 'wb') as f:
+            pickle.dump(self.feature_rules, f, protocol=5)
     
     def load_model(self, model_path='chest_xray_apriori_model.pkl'):
         """Load trained model"""
         if os.path.exists(model_path):
-            with open(model_path, 'rb') as f:
-                model_data = pickle.load(f)
+            # Unpickle straight from a read-only mapping of the file rather
+            # than through buffered reads
+            with open(model_path, 'rb') as f, \
+                    mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                model_data = pickle.loads(mapped)
             
             self.frequent_itemsets = model_data['frequent_itemsets']
             self.rules = model_data['rules']